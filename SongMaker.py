@@ -1,18 +1,58 @@
-import dawdreamer as daw
+try:
+    import dawdreamer as daw
+except ImportError:  # Only the numpy backend can render without it
+    daw = None
 from scipy.io import wavfile
+from scipy.signal import resample_poly
 import mido
 from mido import MidiFile, MidiTrack
 import os
 import numpy as np
-import re
+import struct
+import hashlib
+import json
+import argparse
 import subprocess
+import tempfile
 import time
 import sys
+import multiprocessing
+import threading
+import contextlib
+import math
+from collections import namedtuple
+try:
+    import tomllib
+except ImportError:  # Python < 3.11 can still read JSON song configs
+    tomllib = None
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from midi_timing import DEFAULT_TEMPO, calculate_track_length, tempo_changes
+from midi_catalog import CATALOG_PATH, extract_db_from_track_name, file_sha256, find_midi_files, select_from_catalog
 
 # Constants
 SAMPLE_RATE = 44100
-BUFFER_SIZE = 128
+BUFFER_SIZE = 128  # Block size of plugins without a tuned size in BUFFER_SIZE_CACHE
+BUFFER_SIZE_CANDIDATES = [128, 256, 512, 1024, 2048]
+MAX_AUTOMATION_BLOCK_MS = 12.0  # Tuned block sizes never exceed this, automation moves once per block
+CALIBRATION_SECONDS = 8.0
 PPQN = 960
+RELEASE_TAIL_SECONDS = 2
+TAIL_THRESHOLD_DB = -60.0  # A stem's tail counts as silent once a block's RMS falls below this
+TAIL_BLOCK_SECONDS = 0.25
+FIRST_TAIL_SECONDS = 1.0  # Adaptive tails render this much release first and only continue if it's still loud
+MAX_TAIL_SECONDS = 10.0
+# Partial renders: streamed segments and region re-renders of edited tracks, see render_span
+REGION_PREROLL_SECONDS = 2.0
+REGION_TAIL_SECONDS = 2.0
+CROSSFADE_SECONDS = 0.01
+MAX_HELD_NOTE_SECONDS = 10.0  # Notes held into a partial render are rendered from an attack up to this much earlier
+REGION_MAX_FRACTION = 0.5  # Longer edits re-render the whole track
+RENDER_BACKENDS = ['dawdreamer', 'numpy']
+# Preview renders trade fidelity for speed and are resampled back to SAMPLE_RATE
+PREVIEW_SAMPLE_RATE = 22050
+PREVIEW_BUFFER_SIZE = 1024
+PREVIEW_TAIL_SECONDS = 1.0
+NUMPY_SYNTH_RELEASE_SECONDS = 0.3
 
 # Get the directory of the current script
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -35,19 +75,227 @@ PRESETS = [
     os.path.join(SCRIPT_DIR, 'assets', 'spacelead1.vstpreset'),
     os.path.join(SCRIPT_DIR, 'assets', 'Ob_x-bass.fxp')
 ]
+MIDI_EVENT_CACHE_DIR = os.path.join(SCRIPT_DIR, ".midi_cache")
+STEM_CACHE_DIR = os.path.join(SCRIPT_DIR, ".stem_cache")
+STEM_CACHE_MAX_BYTES = 2 * 1024 ** 3
+PIPELINE_MAX_PENDING = 2  # Rendered stems that may wait for --io-threads before rendering blocks
+BUFFER_SIZE_CACHE = os.path.join(SCRIPT_DIR, "buffer_sizes.json")
+PLUGIN_STATE_DIR = os.path.join(SCRIPT_DIR, ".plugin_state")
+# (plugin, preset) for MIDI tracks 1..7
+TRACK_SYNTHS = list(zip(
+    [SYNTH_PLUGIN1, SYNTH_PLUGIN2, SYNTH_PLUGIN3, SYNTH_PLUGIN4, SYNTH_PLUGIN5, SYNTH_PLUGIN6, SYNTH_PLUGIN7],
+    PRESETS
+))
 
 def make_sine(freq: float, duration: float, sr=SAMPLE_RATE):
     """Return sine wave based on freq in Hz and duration in seconds"""
     N = int(duration * sr)
     return np.sin(np.pi * 2. * freq * np.arange(N) / sr)
 
-def initialize_engine(sample_rate, buffer_size):
+class StageTracer:
+    """Records wall and CPU time of pipeline stages as Chrome trace-event "X" (complete) events.
+
+    Stage args may carry audio_seconds (for the realtime factor) and bytes (written to disk).
+    """
+    enabled = True
+
+    def __init__(self):
+        self.events = []
+
+    @contextlib.contextmanager
+    def stage(self, name, **args):
+        ts = time.time_ns() // 1000
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield
+        finally:
+            args['cpu_ms'] = (time.process_time() - cpu) * 1000
+            self.events.append({'name': name, 'cat': 'songmaker', 'ph': 'X', 'ts': ts,
+                                'dur': (time.perf_counter() - wall) * 1e6,
+                                'pid': os.getpid(), 'tid': threading.get_ident(), 'args': args})
+
+    def write(self, trace_filename):
+        with open(trace_filename, 'w') as f:
+            json.dump({'traceEvents': self.events, 'displayTimeUnit': 'ms'}, f)
+
+    def summary(self):
+        """Per-stage totals as a text table"""
+        totals = {}
+        for event in self.events:
+            total = totals.setdefault(event['name'], [0, 0.0, 0.0, 0.0, 0])
+            total[0] += 1
+            total[1] += event['dur'] / 1e6
+            total[2] += event['args']['cpu_ms'] / 1000
+            total[3] += event['args'].get('audio_seconds', 0.0)
+            total[4] += event['args'].get('bytes', 0)
+
+        lines = [f"{'stage':<16}{'count':>7}{'wall s':>10}{'cpu s':>10}{'rtf':>11}{'MB written':>12}"]
+        for name, (count, wall, cpu, audio_seconds, written) in sorted(totals.items(), key=lambda item: -item[1][1]):
+            rtf = f"{audio_seconds / wall:.2f}x" if audio_seconds and wall else '-'
+            lines.append(f"{name:<16}{count:>7}{wall:>10.3f}{cpu:>10.3f}{rtf:>11}{written / 1024 ** 2:>12.1f}")
+        return '\n'.join(lines)
+
+class NullTracer:
+    """Stand-in while tracing is off, stage() hands back one shared no-op context"""
+    enabled = False
+    events = []
+    _null_stage = contextlib.nullcontext()
+
+    def stage(self, name, **args):
+        return self._null_stage
+
+TRACER = NullTracer()
+
+def enable_tracing():
+    global TRACER
+    TRACER = StageTracer()
+    return TRACER
+
+def _traced_call(trace, function, *args):
+    """Run function in a worker process, handing back its trace events along with the result"""
+    if not trace:
+        return function(*args), []
+    tracer = enable_tracing()
+    return function(*args), tracer.events
+
+class NumpySynth:
+    """Additive reference synth with the plugin processor methods SongMaker calls.
+
+    Every note is the fundamental from make_sine plus its 3rd and 5th partials at 1/n
+    amplitude, held for the note and then decaying over NUMPY_SYNTH_RELEASE_SECONDS.
+    Presets are ignored.
+    """
+
+    def __init__(self, name, plugin_path):
+        self.name = name
+        self.plugin_path = plugin_path
+        self.notes = []  # (note, velocity, start, duration, beats)
+
+    def get_name(self):
+        return self.name
+
+    def load_vst3_preset(self, preset_path):
+        self.preset_path = preset_path
+
+    def load_preset(self, preset_path):
+        self.preset_path = preset_path
+
+    def clear_midi(self):
+        self.notes = []
+
+    def add_midi_note(self, note, velocity, start, duration, beats=False):
+        self.notes.append((note, velocity, start, duration, beats))
+
+    def load_midi(self, midi_path, clear_previous=True, beats=False, all_events=True):
+        """Take the notes of a MIDI file, controllers and pitchwheel have no effect on this synth"""
+        if clear_previous:
+            self.clear_midi()
+        midi = MidiFile(midi_path)
+        tempo_map = extract_tempo_map(midi)
+        starts = {}
+        tick = 0
+        for msg in mido.merge_tracks(midi.tracks):
+            tick += msg.time
+            if msg.type == 'note_on' and msg.velocity > 0:
+                starts[(msg.channel, msg.note)] = (tick, msg.velocity)
+            elif msg.type in ('note_on', 'note_off') and (msg.channel, msg.note) in starts:
+                start_tick, velocity = starts.pop((msg.channel, msg.note))
+                if beats:
+                    start, end = start_tick / midi.ticks_per_beat, tick / midi.ticks_per_beat
+                else:
+                    start, end = ticks_to_seconds([start_tick, tick], tempo_map, midi.ticks_per_beat)
+                self.notes.append((msg.note, velocity, float(start), float(end - start), beats))
+
+    def get_num_input_channels(self):
+        return 0
+
+    def get_num_output_channels(self):
+        return 2
+
+    def render(self, num_samples, beats_to_seconds, sample_rate=SAMPLE_RATE):
+        audio = np.zeros((2, num_samples), dtype=np.float32)
+        for note, velocity, start, duration, beats in self.notes:
+            if beats:
+                start, end = beats_to_seconds(np.array([start, start + duration]))
+                duration = end - start
+            offset = int(round(start * sample_rate))
+            if offset >= num_samples:
+                continue
+            length = min(int((duration + NUMPY_SYNTH_RELEASE_SECONDS) * sample_rate), num_samples - offset)
+            freq = 440.0 * 2 ** ((note - 69) / 12)
+            sine = make_sine(freq, (length + 1) / sample_rate, sample_rate)[:length]
+            # sin(3x) = sin(x)(3 - 4s) and sin(5x) = sin(x)(5 - 20s + 16s^2) with s = sin(x)^2,
+            # so every partial comes out of the one make_sine as a polynomial in s
+            coefficients = np.array([1.0, 0.0, 0.0])
+            if freq * 3 < sample_rate / 2:
+                coefficients += np.array([3.0, -4.0, 0.0]) / 3
+            if freq * 5 < sample_rate / 2:
+                coefficients += np.array([5.0, -20.0, 16.0]) / 5
+            square = sine * sine
+            tone = sine * (coefficients[0] + square * (coefficients[1] + square * coefficients[2]))
+            # Exponential release after the note-off, about -43 dB by its end
+            hold = min(int(duration * sample_rate), length)
+            tone[hold:] *= np.exp(np.arange(length - hold) * (-5 / (NUMPY_SYNTH_RELEASE_SECONDS * sample_rate)))
+            gain = velocity / 127 * 0.2
+            pan = (note % 12) / 11  # Spread pitch classes across the stereo field
+            audio[0, offset:offset + length] += tone * (gain * (1 - pan))
+            audio[1, offset:offset + length] += tone * (gain * pan)
+        return audio
+
+class NumpyEngine:
+    """The part of daw.RenderEngine SongMaker uses, rendering NumpySynth processors without any plugin host"""
+
+    def __init__(self, sample_rate, buffer_size):
+        self.sample_rate = sample_rate
+        self.buffer_size = buffer_size
+        self.bpm = 120.0
+        self.ppqn = PPQN
+        self.graph = []
+        self.audio = np.zeros((2, 0), dtype=np.float32)
+
+    def make_plugin_processor(self, name, plugin_path):
+        return NumpySynth(name, plugin_path)
+
+    def set_bpm(self, bpm, ppqn=PPQN):
+        """A fixed BPM, or one BPM per pulse at ppqn like DawDreamer's tempo automation"""
+        self.bpm = bpm
+        self.ppqn = ppqn
+        if np.ndim(bpm):
+            self.pulse_seconds = 60 / (np.asarray(bpm, dtype=np.float64) * ppqn)
+            self.pulse_starts = np.concatenate([[0.0], np.cumsum(self.pulse_seconds)])
+
+    def beats_to_seconds(self, beats):
+        if np.ndim(self.bpm) == 0:
+            return beats * 60 / self.bpm
+        # Integrate the per-pulse tempo, the last BPM holds after the automation ends
+        pulses = np.asarray(beats, dtype=np.float64) * self.ppqn
+        num_pulses = len(self.pulse_seconds)
+        inside = np.interp(pulses, np.arange(num_pulses + 1), self.pulse_starts)
+        beyond = self.pulse_starts[-1] + (pulses - num_pulses) * self.pulse_seconds[-1]
+        return np.where(pulses > num_pulses, beyond, inside)
+
+    def load_graph(self, graph):
+        self.graph = graph
+
+    def render(self, duration):
+        num_samples = int(duration * self.sample_rate)
+        self.audio = np.zeros((2, num_samples), dtype=np.float32)
+        for processor, _ in self.graph:
+            self.audio += processor.render(num_samples, self.beats_to_seconds, self.sample_rate)
+
+    def get_audio(self):
+        return self.audio
+
+def initialize_engine(sample_rate, buffer_size, backend='dawdreamer'):
+    """A render engine for backend: 'dawdreamer' hosts the real plugins, 'numpy' renders NumpySynth"""
+    if backend == 'numpy':
+        return NumpyEngine(sample_rate, buffer_size)
+    if daw is None:
+        raise ImportError("DawDreamer is not installed, only the numpy backend can render")
     return daw.RenderEngine(sample_rate, buffer_size)
 
-def create_synth(engine, plugin_path, preset_path, name):
-    synth = engine.make_plugin_processor(name, plugin_path)
-    assert synth.get_name() == name
-    
+def load_preset_into_synth(synth, preset_path):
     # Check the file extension and load the preset accordingly
     _, ext = os.path.splitext(preset_path)
     if ext == '.vstpreset':
@@ -56,7 +304,47 @@ def create_synth(engine, plugin_path, preset_path, name):
         synth.load_preset(preset_path)
     else:
         raise ValueError(f"Unsupported preset file extension: {ext}")
-    
+
+def plugin_state_key(plugin_path, preset_path):
+    """Hash of the plugin binary's identity and the preset's bytes"""
+    digest = hashlib.sha256()
+    digest.update(os.path.abspath(plugin_path).encode())
+    if os.path.exists(plugin_path):  # A rebuilt or updated plugin may read the state differently
+        stat = os.stat(plugin_path)
+        digest.update(repr((stat.st_size, stat.st_mtime_ns)).encode())
+    with open(preset_path, 'rb') as f:
+        digest.update(f.read())
+    return digest.hexdigest()
+
+def load_preset_snapshot(synth, plugin_path, preset_path, state_dir=PLUGIN_STATE_DIR):
+    """load_preset_into_synth, but restore the plugin's saved state when this plugin + preset was loaded before.
+
+    The first load parses the preset as usual and saves the plugin's complete state,
+    later loads hand that blob straight back. Processors without save_state/load_state
+    (the numpy backend) always load the preset.
+    """
+    if not state_dir or not hasattr(synth, 'load_state'):
+        load_preset_into_synth(synth, preset_path)
+        return
+    state_path = os.path.join(state_dir, plugin_state_key(plugin_path, preset_path) + '.state')
+    if os.path.exists(state_path):
+        try:
+            synth.load_state(state_path)
+            return
+        except Exception as e:
+            print(f"Warning: Could not restore plugin state {state_path} ({e}), loading the preset instead.")
+    load_preset_into_synth(synth, preset_path)
+    os.makedirs(state_dir, exist_ok=True)
+    temp_path = state_path + f'.{os.getpid()}.tmp'
+    synth.save_state(temp_path)
+    os.replace(temp_path, state_path)
+
+def create_synth(engine, plugin_path, preset_path, name, state_dir=PLUGIN_STATE_DIR):
+    with TRACER.stage('plugin_load', plugin=os.path.basename(plugin_path)):
+        synth = engine.make_plugin_processor(name, plugin_path)
+    assert synth.get_name() == name
+    with TRACER.stage('preset_load', preset=os.path.basename(preset_path)):
+        load_preset_snapshot(synth, plugin_path, preset_path, state_dir)
     return synth
 
 def load_midi_tracks(midi_path):
@@ -70,6 +358,79 @@ def extract_tempo_from_track_0(track):
             return msg.tempo
     return None
 
+def extract_tempo_map(midi):
+    """Return (ticks, tempos) arrays of every set_tempo in the file, always starting at tick 0"""
+    changes = tempo_changes(midi)
+    ticks = np.array(sorted(changes), dtype=np.int64)
+    tempos = np.array([changes[tick] for tick in ticks], dtype=np.float64)
+    return ticks, tempos
+
+def _tempo_map_seconds(tempo_map, ticks_per_beat):
+    # Seconds per tick in each tempo segment and the time at which each segment starts
+    change_ticks, tempos = tempo_map
+    seconds_per_tick = tempos / 1e6 / ticks_per_beat
+    change_seconds = np.concatenate(([0.0], np.cumsum(np.diff(change_ticks) * seconds_per_tick[:-1])))
+    return seconds_per_tick, change_seconds
+
+def ticks_to_seconds(ticks, tempo_map, ticks_per_beat):
+    """Convert absolute ticks (scalar or array) to seconds through the whole tempo map"""
+    change_ticks = tempo_map[0]
+    seconds_per_tick, change_seconds = _tempo_map_seconds(tempo_map, ticks_per_beat)
+    ticks = np.asarray(ticks, dtype=np.float64)
+    segment = np.searchsorted(change_ticks, ticks, side='right') - 1
+    return change_seconds[segment] + (ticks - change_ticks[segment]) * seconds_per_tick[segment]
+
+def seconds_to_ticks(seconds, tempo_map, ticks_per_beat):
+    """Inverse of ticks_to_seconds"""
+    change_ticks = tempo_map[0]
+    seconds_per_tick, change_seconds = _tempo_map_seconds(tempo_map, ticks_per_beat)
+    seconds = np.asarray(seconds, dtype=np.float64)
+    segment = np.searchsorted(change_seconds, seconds, side='right') - 1
+    return change_ticks[segment] + (seconds - change_seconds[segment]) / seconds_per_tick[segment]
+
+def extract_time_signatures(midi):
+    """Return (ticks, beats_per_bar) arrays of every time_signature, in quarter notes, 4/4 until the first one"""
+    changes = {0: 4.0}
+    for track in midi.tracks:
+        tick = 0
+        for msg in track:
+            tick += msg.time
+            if msg.type == 'time_signature':
+                changes[tick] = msg.numerator * 4 / msg.denominator
+    ticks = np.array(sorted(changes), dtype=np.int64)
+    return ticks, np.array([changes[tick] for tick in ticks], dtype=np.float64)
+
+def bars_to_ticks(bars, time_signatures, ticks_per_beat):
+    """Tick at which each 1-based bar number (scalar or array) starts"""
+    change_ticks, beats_per_bar = time_signatures
+    ticks_per_bar = beats_per_bar * ticks_per_beat
+    # Bars elapsed at each time signature change
+    change_bars = np.concatenate([[0.0], np.cumsum(np.diff(change_ticks) / ticks_per_bar[:-1])])
+    bars = np.asarray(bars, dtype=np.float64) - 1
+    segment = np.searchsorted(change_bars, bars, side='right') - 1
+    return (change_ticks[segment] + (bars - change_bars[segment]) * ticks_per_bar[segment]).astype(np.int64)
+
+def parse_bar_range(text):
+    """'9-16' -> (9, 16), '9' -> (9, 9); both ends inclusive"""
+    first, _, last = text.partition('-')
+    first, last = int(first), int(last or first)
+    if first < 1 or last < first:
+        raise ValueError(f"Invalid bar range: {text}")
+    return first, last
+
+def set_engine_tempo(engine, tempo_map, ticks_per_beat, start_tick=0, end_tick=0):
+    """Set a fixed BPM, or per-tick BPM automation over [start_tick, end_tick) when the tempo changes there"""
+    change_ticks, tempos = tempo_map
+    first = np.searchsorted(change_ticks, start_tick, side='right') - 1
+    last = np.searchsorted(change_ticks, max(end_tick - 1, start_tick), side='right') - 1
+    if first == last:
+        engine.set_bpm(mido.tempo2bpm(tempos[first]))
+        return
+
+    pulses = np.arange(start_tick, end_tick)
+    bpm = 60e6 / tempos[np.searchsorted(change_ticks, pulses, side='right') - 1]
+    engine.set_bpm(bpm, ppqn=ticks_per_beat)
+
 def filter_midi_events(track):
     filtered_track = MidiTrack()
     for msg in track:
@@ -77,20 +438,394 @@ def filter_midi_events(track):
             filtered_track.append(msg)
     return filtered_track
 
-def assign_midi_to_synth(synth, midi_events):
-    temp_midi = MidiFile()
+# Compact per-track event arrays: one row per message with its absolute tick
+EVENT_DTYPE = np.dtype([
+    ('tick', np.int64),
+    ('type', np.uint8),
+    ('channel', np.uint8),
+    ('note', np.uint8),      # note number, also for polytouch
+    ('velocity', np.uint8),  # note velocity, aftertouch/polytouch pressure
+    ('control', np.uint8),   # CC number
+    ('value', np.int32),     # CC value, pitch, program, or tempo for set_tempo
+])
+NOTE_ON, NOTE_OFF, CONTROL_CHANGE, PITCHWHEEL, PROGRAM_CHANGE, AFTERTOUCH, POLYTOUCH = range(1, 8)
+SET_TEMPO, END_OF_TRACK, OTHER_META = 16, 17, 18  # Types >= SET_TEMPO are meta events
+EVENT_FORMAT_VERSION = 1  # Part of the MIDI cache's file names, bump it with any change to EVENT_DTYPE or _message_row
+MidiEvents = namedtuple('MidiEvents', ['ticks_per_beat', 'names', 'tracks'])
+
+def _message_row(tick, msg):
+    t = msg.type
+    if t == 'note_on':
+        return (tick, NOTE_ON, msg.channel, msg.note, msg.velocity, 0, 0)
+    if t == 'note_off':
+        return (tick, NOTE_OFF, msg.channel, msg.note, msg.velocity, 0, 0)
+    if t == 'control_change':
+        return (tick, CONTROL_CHANGE, msg.channel, 0, 0, msg.control, msg.value)
+    if t == 'pitchwheel':
+        return (tick, PITCHWHEEL, msg.channel, 0, 0, 0, msg.pitch)
+    if t == 'program_change':
+        return (tick, PROGRAM_CHANGE, msg.channel, 0, 0, 0, msg.program)
+    if t == 'aftertouch':
+        return (tick, AFTERTOUCH, msg.channel, 0, msg.value, 0, 0)
+    if t == 'polytouch':
+        return (tick, POLYTOUCH, msg.channel, msg.note, msg.value, 0, 0)
+    if t == 'set_tempo':
+        return (tick, SET_TEMPO, 0, 0, 0, 0, msg.tempo)
+    if t == 'end_of_track':
+        return (tick, END_OF_TRACK, 0, 0, 0, 0, 0)
+    if msg.is_meta:
+        return (tick, OTHER_META, 0, 0, 0, 0, 0)
+    return None  # sysex and other system messages aren't sent to the synths
+
+def track_to_event_array(track):
+    ticks = np.cumsum([msg.time for msg in track], dtype=np.int64)
+    rows = [_message_row(tick, msg) for tick, msg in zip(ticks.tolist(), track)]
+    return np.array([row for row in rows if row is not None], dtype=EVENT_DTYPE)
+
+def filter_event_array(events):
+    """Vectorized filter_midi_events, keeps absolute ticks so dropped meta events can't shift timing"""
+    return events[events['type'] < SET_TEMPO]
+
+def event_array_length(events):
+    return int(events['tick'].max()) if len(events) else 0
+
+def event_array_to_track(events):
+    """Rebuild mido messages with delta times, for handing an event array to a synth"""
+    track = MidiTrack()
+    deltas = np.diff(events['tick'], prepend=0).tolist()
+    for delta, row in zip(deltas, events.tolist()):
+        _, t, channel, note, velocity, control, value = row
+        if t == NOTE_ON:
+            msg = mido.Message('note_on', channel=channel, note=note, velocity=velocity)
+        elif t == NOTE_OFF:
+            msg = mido.Message('note_off', channel=channel, note=note, velocity=velocity)
+        elif t == CONTROL_CHANGE:
+            msg = mido.Message('control_change', channel=channel, control=control, value=value)
+        elif t == PITCHWHEEL:
+            msg = mido.Message('pitchwheel', channel=channel, pitch=value)
+        elif t == PROGRAM_CHANGE:
+            msg = mido.Message('program_change', channel=channel, program=value)
+        elif t == AFTERTOUCH:
+            msg = mido.Message('aftertouch', channel=channel, value=velocity)
+        elif t == POLYTOUCH:
+            msg = mido.Message('polytouch', channel=channel, note=note, value=velocity)
+        elif t == SET_TEMPO:
+            msg = mido.MetaMessage('set_tempo', tempo=value)
+        elif t == END_OF_TRACK:
+            msg = mido.MetaMessage('end_of_track')
+        else:
+            # Other meta events only matter for their timing, keep it with an empty marker
+            msg = mido.MetaMessage('marker', text='')
+        track.append(msg.copy(time=delta))
+    return track
+
+def tempo_map_from_event_arrays(tracks):
+    """extract_tempo_map for event arrays"""
+    tempo_events = np.concatenate([events[events['type'] == SET_TEMPO] for events in tracks] +
+                                  [np.zeros(0, dtype=EVENT_DTYPE)])
+    # Stable sort so that, as in extract_tempo_map, the last of several changes on one tick wins
+    tempo_events = tempo_events[np.argsort(tempo_events['tick'], kind='stable')]
+    ticks = np.concatenate(([0], tempo_events['tick']))
+    tempos = np.concatenate(([DEFAULT_TEMPO], tempo_events['value'])).astype(np.float64)
+    last_of_tick = np.append(ticks[1:] != ticks[:-1], True)
+    return ticks[last_of_tick], tempos[last_of_tick]
+
+def get_track_events(song, track_index):
+    """A track's channel events as a mido track, ready for send_midi_to_synth"""
+    return event_array_to_track(filter_event_array(song.tracks[track_index]))
+
+def parse_midi_events(midi_path):
+    midi = MidiFile(midi_path)
+    names = [track.name for track in midi.tracks]
+    return MidiEvents(midi.ticks_per_beat, names, [track_to_event_array(track) for track in midi.tracks])
+
+def load_midi_events(midi_path, cache_dir=MIDI_EVENT_CACHE_DIR):
+    """parse_midi_events with an .npz cache keyed by the file's hash and EVENT_FORMAT_VERSION, re-parsing is one load"""
+    if not cache_dir:
+        return parse_midi_events(midi_path)
+
+    with open(midi_path, 'rb') as f:
+        file_hash = hashlib.sha256(f.read()).hexdigest()
+    cache_path = os.path.join(cache_dir, f'{file_hash}.v{EVENT_FORMAT_VERSION}.npz')
+    try:
+        with np.load(cache_path) as cached:
+            num_tracks = int(cached['num_tracks'])
+            return MidiEvents(int(cached['ticks_per_beat']), [str(name) for name in cached['names']],
+                              [cached[f'track_{i}'] for i in range(num_tracks)])
+    except (OSError, KeyError, ValueError):
+        pass
+
+    song = parse_midi_events(midi_path)
+    os.makedirs(cache_dir, exist_ok=True)
+    temp_path = cache_path + f'.{os.getpid()}.tmp.npz'
+    np.savez(temp_path, ticks_per_beat=song.ticks_per_beat, num_tracks=len(song.tracks),
+             names=np.array(song.names, dtype=str),
+             **{f'track_{i}': events for i, events in enumerate(song.tracks)})
+    os.replace(temp_path, cache_path)
+    return song
+
+def assign_midi_to_synth(synth, midi_events, ticks_per_beat=PPQN):
+    """Load events through a MIDI file. Needed for events add_midi_note can't express (pitchwheel, CC)"""
+    temp_midi = MidiFile(ticks_per_beat=ticks_per_beat)
     temp_midi.tracks.append(midi_events)
-    temp_midi_path = 'temp_midi.mid'
-    temp_midi.save(temp_midi_path)
-    synth.load_midi(temp_midi_path, beats=True)
-    return temp_midi_path
+    # Unique file per call so concurrent jobs in the same directory don't clobber each other
+    fd, temp_midi_path = tempfile.mkstemp(suffix='.mid', prefix='songmaker_')
+    os.close(fd)
+    try:
+        temp_midi.save(temp_midi_path)
+        synth.load_midi(temp_midi_path, clear_previous=True, beats=True)
+    finally:
+        os.remove(temp_midi_path)
+
+def midi_events_to_notes(midi_events, ticks_per_beat):
+    """Pair note_on/note_off messages into (note, velocity, start_beats, duration_beats) tuples"""
+    notes = []
+    open_notes = {}
+    tick = 0
+    for msg in midi_events:
+        tick += msg.time
+        if msg.type == 'note_on' and msg.velocity > 0:
+            open_notes.setdefault((msg.channel, msg.note), []).append((tick, msg.velocity))
+        elif msg.type == 'note_off' or msg.type == 'note_on':
+            pending = open_notes.get((msg.channel, msg.note))
+            if pending:
+                start, velocity = pending.pop(0)
+                notes.append((msg.note, velocity, start / ticks_per_beat, (tick - start) / ticks_per_beat))
+
+    # Notes still held at the end of the track last until the final event
+    for (channel, note), pending in open_notes.items():
+        for start, velocity in pending:
+            notes.append((note, velocity, start / ticks_per_beat, (tick - start) / ticks_per_beat))
+
+    notes.sort(key=lambda n: n[2])
+    return notes
+
+def has_only_note_events(midi_events):
+    """Whether add_midi_note can express the track: notes only, all on channel 0 since it takes no channel"""
+    return all(msg.type in ('note_on', 'note_off') and msg.channel == 0 for msg in midi_events if not msg.is_meta)
+
+def send_midi_to_synth(synth, midi_events, ticks_per_beat):
+    """Hand the track to the synth in memory, falling back to a MIDI file for pitchwheel/CC data and other channels"""
+    with TRACER.stage('midi_prep', events=len(midi_events)):
+        if not has_only_note_events(midi_events):
+            assign_midi_to_synth(synth, midi_events, ticks_per_beat)
+            return
+
+        synth.clear_midi()
+        for note, velocity, start, duration in midi_events_to_notes(midi_events, ticks_per_beat):
+            synth.add_midi_note(note, velocity, start, duration, beats=True)
+
+def slice_midi_events(midi_events, start_tick, end_tick):
+    """Re-time the events in [start_tick, end_tick) to start at zero.
+
+    Notes held across start_tick are struck again and the last pitchwheel/CC/program
+    values are replayed at zero, so the synth enters the slice in the state it was in.
+    Notes still open at end_tick are closed there.
+    """
+    held = {}
+    controls = {}
+    in_range = []
+    tick = 0
+    for msg in midi_events:
+        tick += msg.time
+        if tick >= end_tick:
+            break
+        if tick >= start_tick:
+            in_range.append((tick - start_tick, msg))
+        elif msg.type == 'note_on' and msg.velocity > 0:
+            held[(msg.channel, msg.note)] = msg
+        elif msg.type in ('note_off', 'note_on'):
+            held.pop((msg.channel, msg.note), None)
+        elif msg.type == 'control_change':
+            controls[(msg.type, msg.channel, msg.control)] = msg
+        elif msg.type in ('pitchwheel', 'program_change', 'aftertouch'):
+            controls[(msg.type, msg.channel)] = msg
+
+    sliced = MidiTrack()
+    for msg in list(controls.values()) + list(held.values()):
+        sliced.append(msg.copy(time=0))
+
+    open_notes = dict(held)
+    previous = 0
+    for tick, msg in in_range:
+        sliced.append(msg.copy(time=tick - previous))
+        previous = tick
+        if msg.type == 'note_on' and msg.velocity > 0:
+            open_notes[(msg.channel, msg.note)] = msg
+        elif msg.type in ('note_off', 'note_on'):
+            open_notes.pop((msg.channel, msg.note), None)
+
+    close_time = end_tick - start_tick - previous
+    for channel, note in open_notes:
+        sliced.append(mido.Message('note_off', channel=channel, note=note, velocity=0, time=close_time))
+        close_time = 0
+    return sliced
+
+def held_notes_start(midi_events, tick):
+    """Earliest note-on of the notes still sounding at tick, or tick itself when none are"""
+    open_notes = {}
+    current = 0
+    for msg in midi_events:
+        current += msg.time
+        if current >= tick:
+            break
+        if msg.type == 'note_on' and msg.velocity > 0:
+            open_notes.setdefault((msg.channel, msg.note), current)
+        elif msg.type in ('note_off', 'note_on'):
+            open_notes.pop((msg.channel, msg.note), None)
+    return min(open_notes.values(), default=tick)
+
+def changed_tick_range(old_events, new_events, ticks_per_beat):
+    """(start_tick, end_tick) covering every difference between two filtered event arrays, None if equal.
+
+    The range runs from the first differing event to the last note-off of any note, in
+    either version, that sounds inside it, so a shortened or lengthened note is covered.
+    """
+    common = min(len(old_events), len(new_events))
+    differs = old_events[:common] != new_events[:common]
+    prefix = int(np.argmax(differs)) if differs.any() else common
+    if prefix == common and len(old_events) == len(new_events):
+        return None
+    # Matching events at the end, not overlapping the matching prefix
+    tail = common - prefix
+    differs = old_events[len(old_events) - tail:][::-1] != new_events[len(new_events) - tail:][::-1]
+    suffix = int(np.argmax(differs)) if differs.any() else tail
+
+    changed_ticks = np.concatenate((old_events['tick'][prefix:len(old_events) - suffix],
+                                    new_events['tick'][prefix:len(new_events) - suffix]))
+    start_tick, end_tick = int(changed_ticks.min()), int(changed_ticks.max())
+    for events in (old_events, new_events):
+        for _, _, start, duration in midi_events_to_notes(event_array_to_track(events), ticks_per_beat):
+            note_start, note_end = start * ticks_per_beat, (start + duration) * ticks_per_beat
+            if note_start <= end_tick and note_end >= start_tick:
+                end_tick = max(end_tick, int(round(note_end)))
+    return start_tick, end_tick
 
 def render_audio(engine, duration):
-    engine.render(duration)
-    return engine.get_audio()
+    with TRACER.stage('render', audio_seconds=duration):
+        engine.render(duration)
+        return engine.get_audio()
+
+def read_stem(filename):
+    """A WAV written by save_audio as a writable (channels, samples) float32 array"""
+    _, data = wavfile.read(filename)
+    return np.ascontiguousarray(data.T, dtype=np.float32)
 
 def save_audio(filename, sample_rate, audio):
-    wavfile.write(filename, sample_rate, audio.transpose())
+    """Write (channels, samples) audio, float32 is interleaved a second at a time rather than as one transposed copy"""
+    with TRACER.stage('wav_write', bytes=audio.nbytes, audio_seconds=audio.shape[-1] / sample_rate):
+        if audio.dtype != np.float32:
+            wavfile.write(filename, sample_rate, audio.transpose())
+            return
+        with WavStreamWriter(filename, sample_rate, audio.shape[0]) as writer:
+            for offset in range(0, audio.shape[1], sample_rate):
+                writer.write(audio[:, offset:offset + sample_rate])
+
+def peak_abs(audio, chunk_samples=SAMPLE_RATE):
+    """max(abs(audio)) without materializing abs(audio), one chunk of samples at a time"""
+    peak = 0.0
+    for offset in range(0, audio.shape[-1], chunk_samples):
+        chunk = audio[..., offset:offset + chunk_samples]
+        peak = max(peak, float(chunk.max()), -float(chunk.min()))
+    return peak
+
+def normalize_in_place(audio, db_value):
+    """Scale audio so its peak sits at db_value dBFS with a single in-place float32 multiply.
+
+    Returns the (possibly converted) buffer, or None when the audio is silent.
+    """
+    with TRACER.stage('normalize', audio_seconds=audio.shape[-1] / SAMPLE_RATE):
+        max_abs_audio = peak_abs(audio)
+        if max_abs_audio == 0:
+            return None
+        if audio.dtype != np.float32:
+            audio = audio.astype(np.float32)
+        audio *= np.float32(10 ** (db_value / 20) / max_abs_audio)
+        return audio
+
+class WavStreamWriter:
+    """Append (channels, samples) float32 blocks to a WAV file, the header sizes are patched on close"""
+
+    def __init__(self, filename, sample_rate, num_channels):
+        self.file = open(filename, 'wb')
+        self.sample_rate = sample_rate
+        self.num_channels = num_channels
+        self.data_bytes = 0
+        self._write_header()
+
+    def _write_header(self):
+        block_align = 4 * self.num_channels
+        self.file.seek(0)
+        # WAVE_FORMAT_IEEE_FLOAT (3), 32 bits per sample
+        self.file.write(struct.pack('<4sI4s4sIHHIIHH4sI',
+                                    b'RIFF', 36 + self.data_bytes, b'WAVE',
+                                    b'fmt ', 16, 3, self.num_channels, self.sample_rate,
+                                    self.sample_rate * block_align, block_align, 32,
+                                    b'data', self.data_bytes))
+        self.file.seek(0, os.SEEK_END)
+
+    def write(self, audio):
+        frames = np.ascontiguousarray(audio.T, dtype='<f4')
+        self.file.write(frames.tobytes())
+        self.data_bytes += frames.nbytes
+
+    def close(self):
+        self._write_header()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def reapeaks_divisions(sample_rate):
+    # Samples per peak of each mipmap level, REAPER uses 300, 20 and 1 peaks per second (147/2205/44100 at 44.1 kHz)
+    return (sample_rate // 300, sample_rate // 20, sample_rate)
+
+def compute_peak_mipmaps(audio, divisions, chunk_seconds=60):
+    """Per-channel block (max, min) of (channels, samples) audio for each division.
+
+    Works through the audio a whole number of the largest division at a time,
+    so a memory-mapped stem is never loaded in full.
+    """
+    chunk = divisions[-1] * chunk_seconds
+    levels = [([], []) for _ in divisions]
+    for offset in range(0, audio.shape[1], chunk):
+        block = np.asarray(audio[:, offset:offset + chunk])
+        for division, (maxima, minima) in zip(divisions, levels):
+            starts = np.arange(0, block.shape[1], division)
+            maxima.append(np.maximum.reduceat(block, starts, axis=1))
+            minima.append(np.minimum.reduceat(block, starts, axis=1))
+    return [(np.concatenate(maxima, axis=1), np.concatenate(minima, axis=1)) for maxima, minima in levels]
+
+def write_reapeaks(wav_filename, audio, sample_rate, peaks_dir=None):
+    """Write REAPER's peak cache for a WAV that is already on disk, from its samples in memory.
+
+    Same RPKL layout REAPER builds itself: header with the source's rate, mtime and size,
+    a (division, count) table per mipmap, then per peak the 16-bit max and min of each
+    channel in turn. REAPER checks mtime and size, so write this after the WAV itself.
+    """
+    if peaks_dir is None:
+        peaks_dir = os.path.join(os.path.dirname(wav_filename), 'peaks')
+    os.makedirs(peaks_dir, exist_ok=True)
+    peaks_filename = os.path.join(peaks_dir, os.path.basename(wav_filename) + '.reapeaks')
+
+    divisions = reapeaks_divisions(sample_rate)
+    with TRACER.stage('reapeaks', audio_seconds=audio.shape[-1] / sample_rate):
+        mipmaps = compute_peak_mipmaps(audio, divisions)
+    stat = os.stat(wav_filename)
+    num_channels = audio.shape[0]
+    with open(peaks_filename, 'wb') as f:
+        f.write(struct.pack('<4sBBIII', b'RPKL', num_channels, len(divisions), sample_rate,
+                            int(stat.st_mtime) & 0xFFFFFFFF, stat.st_size & 0xFFFFFFFF))
+        for division, (maxima, _) in zip(divisions, mipmaps):
+            f.write(struct.pack('<II', division, maxima.shape[1]))
+        for maxima, minima in mipmaps:
+            # (channels, 2, peaks) -> peaks x [max0, min0, max1, min1, ...]
+            peaks = np.stack([maxima, minima], axis=1).transpose(2, 0, 1)
+            f.write(np.clip(np.round(peaks * 32767), -32768, 32767).astype('<i2').tobytes())
+    return peaks_filename
 
 def mix_audio_files_with_ffmpeg(filenames, output_filename):
     input_args = []
@@ -102,134 +837,1233 @@ def mix_audio_files_with_ffmpeg(filenames, output_filename):
     # Adjust audio volume to +12dB
     volume_filter = f"volume=+12dB"
     
-    subprocess.run(['ffmpeg', *input_args, '-filter_complex', f"{amix_filter},{volume_filter}", '-y', output_filename])
+    with TRACER.stage('ffmpeg_mix', inputs=len(filenames)):
+        subprocess.run(['ffmpeg', *input_args, '-filter_complex', f"{amix_filter},{volume_filter}", '-y', output_filename])
 
-def extract_db_from_track_name(track_name):
-    match = re.search(r'_v(-?\d+(\.\d+)?)dB', track_name)
-    if match:
-        return float(match.group(1))
-    return None
+def soft_limit(audio, threshold_db=-1.0):
+    """Smoothly compress peaks above threshold_db so the output stays within full scale"""
+    threshold = np.float32(10 ** (threshold_db / 20))
+    headroom = np.float32(1.0) - threshold
+    over = np.abs(audio) > threshold
+    magnitude = np.abs(audio[over])
+    audio[over] = np.sign(audio[over]) * (threshold + headroom * np.tanh((magnitude - threshold) / headroom))
+    return audio
 
-def calculate_track_length(track):
-    total_time = 0
-    for msg in track:
-        total_time += msg.time
-        if msg.type == 'end_of_track':
-            break
-    return total_time
+def report_mix_peak(peak):
+    """Print the mix's peak level and warn when it goes over full scale"""
+    peak_db = 20 * math.log10(peak) if peak > 0 else -math.inf
+    print(f"Mix peak: {peak_db:.1f} dBFS")
+    if peak > 1.0:
+        print(f"Warning: the mix clips at {peak_db:+.1f} dBFS, leave the limiter on "
+              f"or use --master-gain-db {-math.ceil(peak_db * 10) / 10:.1f} or lower")
 
-def get_longest_track_length_seconds(midi):
-    longest_track_length = 0
-    longest_track_index = -1
+def mix_stems(stems, master_gain_db=0.0, limiter=False):
+    """Sum (channels, samples) stems in float32, padding to the longest like amix duration=longest.
 
-    for i, track in enumerate(midi.tracks):
-        track_length = calculate_track_length(track)
-        if track_length > longest_track_length:
-            longest_track_length = track_length
-            longest_track_index = i
+    The stems come in at their per-track level, normalization already applied each track's dB.
+    """
+    # A song without synth tracks mixes to an empty stereo file
+    num_channels = max((stem.shape[0] for stem in stems), default=2)
+    num_samples = max((stem.shape[1] for stem in stems), default=0)
 
-    # Ensure the tempo is defined
-    tempo = 500000  # Default tempo (120 BPM) in microseconds per beat
-    for msg in midi.tracks[0]:
-        if msg.type == 'set_tempo':
-            tempo = msg.tempo
-            break
+    with TRACER.stage('mix', audio_seconds=num_samples / SAMPLE_RATE, stems=len(stems)):
+        mix = np.zeros((num_channels, num_samples), dtype=np.float32)
+        for stem in stems:
+            mix[:stem.shape[0], :stem.shape[1]] += stem.astype(np.float32, copy=False)
 
-    # Convert the longest track length from ticks to seconds
-    longest_track_length_seconds = mido.tick2second(longest_track_length, midi.ticks_per_beat, tempo)
-    return longest_track_length_seconds
+        if master_gain_db:
+            mix *= np.float32(10 ** (master_gain_db / 20))
+        if limiter:
+            soft_limit(mix)
+    report_mix_peak(peak_abs(mix))
+    return mix
 
-def main():
-    engine = initialize_engine(SAMPLE_RATE, BUFFER_SIZE)
-    
-    synths = [
-        create_synth(engine, SYNTH_PLUGIN1, PRESETS[0], "my_synth_1"),
-        create_synth(engine, SYNTH_PLUGIN2, PRESETS[1], "my_synth_2"),
-        create_synth(engine, SYNTH_PLUGIN3, PRESETS[2], "my_synth_3"),
-        create_synth(engine, SYNTH_PLUGIN4, PRESETS[3], "my_synth_4"),
-        create_synth(engine, SYNTH_PLUGIN5, PRESETS[4], "my_synth_5"),
-        create_synth(engine, SYNTH_PLUGIN6, PRESETS[5], "my_synth_6"),
-        create_synth(engine, SYNTH_PLUGIN7, PRESETS[6], "my_synth_7")
-    ]
-    
-    midi_tracks = load_midi_tracks(MIDI_PATH)
-    temp_midi_files = []
+def get_longest_track_length_ticks(midi):
+    return max((calculate_track_length(track) for track in midi.tracks), default=0)
+
+def get_song_length_seconds(song, tempo_map=None):
+    """get_longest_track_length_seconds for a MidiEvents song"""
+    if tempo_map is None:
+        tempo_map = tempo_map_from_event_arrays(song.tracks)
+    longest = max((event_array_length(events) for events in song.tracks), default=0)
+    return float(ticks_to_seconds(longest, tempo_map, song.ticks_per_beat))
+
+def get_longest_track_length_seconds(midi, tempo_map=None):
+    if tempo_map is None:
+        tempo_map = extract_tempo_map(midi)
+
+    # Convert the longest track length from ticks to seconds across every tempo change
+    return float(ticks_to_seconds(get_longest_track_length_ticks(midi), tempo_map, midi.ticks_per_beat))
+
+def get_events_end_seconds(events, tempo_map, ticks_per_beat):
+    """Time of the last event of a filtered event array, normally its last note-off"""
+    return float(ticks_to_seconds(event_array_length(events), tempo_map, ticks_per_beat))
+
+def block_rms_db(audio, block_samples):
+    """RMS level in dBFS of each whole block_samples block of a (channels, samples) array"""
+    num_blocks = audio.shape[1] // block_samples
+    blocks = audio[:, :num_blocks * block_samples].reshape(audio.shape[0], num_blocks, block_samples)
+    rms = np.sqrt(np.mean(np.square(blocks, dtype=np.float64), axis=(0, 2)))
+    return 20 * np.log10(np.maximum(rms, 1e-12))
+
+def trim_tail(audio, threshold_db=TAIL_THRESHOLD_DB, block_seconds=TAIL_BLOCK_SECONDS, keep_samples=0):
+    """Cut the audio after the last block past keep_samples that is louder than threshold_db"""
+    block = max(1, int(block_seconds * SAMPLE_RATE))
+    start = min(keep_samples, audio.shape[1])
+    loud = np.nonzero(block_rms_db(audio[:, start:], block) >= threshold_db)[0]
+    cut = start + (loud[-1] + 1) * block if len(loud) else start
+    # Keep a trailing partial block only if the audio is still loud right before it
+    if len(loud) and cut + block > audio.shape[1]:
+        cut = audio.shape[1]
+    return audio[:, :cut]
+
+def render_span(engine, synth, midi_events, ticks_per_beat, tempo_map, start, end,
+                preroll_seconds=REGION_PREROLL_SECONDS):
+    """Render seconds [start, end) of a track after preroll_seconds of its MIDI, returns (audio, first sample).
+
+    DawDreamer restarts from time zero on every render, so the MIDI and tempo are re-timed
+    to start on a tick, picked within a beat so that it also falls on a sample and the notes
+    land where the full render puts them. Notes already held there are rendered from their
+    attack, up to MAX_HELD_NOTE_SECONDS earlier, rather than struck again mid-note.
+    """
+    def to_tick(seconds):
+        return int(seconds_to_ticks(max(0.0, seconds), tempo_map, ticks_per_beat))
+
+    render_start_tick = max(held_notes_start(midi_events, to_tick(start - preroll_seconds)),
+                            to_tick(start - preroll_seconds - MAX_HELD_NOTE_SECONDS))
+    candidates = np.arange(max(0, render_start_tick - ticks_per_beat), render_start_tick + 1)
+    positions = ticks_to_seconds(candidates, tempo_map, ticks_per_beat) * SAMPLE_RATE
+    render_start_tick = int(candidates[np.argmin(np.abs(positions - np.round(positions)))])
+    render_start = float(ticks_to_seconds(render_start_tick, tempo_map, ticks_per_beat))
+    end_tick = int(np.ceil(seconds_to_ticks(end, tempo_map, ticks_per_beat)))
+    set_engine_tempo(engine, tempo_map, ticks_per_beat, render_start_tick, end_tick)
+    send_midi_to_synth(synth, slice_midi_events(midi_events, render_start_tick, end_tick), ticks_per_beat)
+    engine.load_graph([(synth, [])])
+    audio = render_audio(engine, end - render_start)
+
+    first = int(round(render_start * SAMPLE_RATE))
+    length = int(round(end * SAMPLE_RATE)) - first
+    if audio.shape[1] < length:
+        audio = np.pad(audio, ((0, 0), (0, length - audio.shape[1])))
+    return audio[:, :length], first
+
+def equal_power_crossfade(outgoing, incoming):
+    """Fade from outgoing to incoming (at least as long) over outgoing's length with sin/cos gains"""
+    ramp = (np.arange(outgoing.shape[1]) + 0.5) / max(outgoing.shape[1], 1) * (np.pi / 2)
+    return (outgoing * np.cos(ramp).astype(outgoing.dtype) +
+            incoming[:, :outgoing.shape[1]] * np.sin(ramp).astype(outgoing.dtype))
+
+def linear_crossfade(outgoing, incoming):
+    """Fade from outgoing to incoming (at least as long) over outgoing's length with linear gains.
+
+    For seams between two renders of the same MIDI, which are nearly identical: their
+    gains sum to one, where equal-power gains would lift the seam by 3 dB.
+    """
+    ramp = ((np.arange(outgoing.shape[1]) + 0.5) / max(outgoing.shape[1], 1)).astype(outgoing.dtype)
+    return outgoing * (1 - ramp) + incoming[:, :outgoing.shape[1]] * ramp
+
+def render_track_streaming(engine, synth, midi_events, ticks_per_beat, tempo_map, render_duration, filename,
+                           segment_seconds, preroll_seconds=REGION_PREROLL_SECONDS, note_end_seconds=None,
+                           tail_threshold_db=None, crossfade_seconds=CROSSFADE_SECONDS):
+    """Render one track segment by segment straight into a WAV file, returns the stem's peak.
+
+    Each segment is rendered by render_span with preroll_seconds of the preceding MIDI in
+    front of it, and only the segment itself is kept. Its last crossfade_seconds are held
+    back and linearly crossfaded into the next segment, which starts that much early, so
+    seams don't click. Memory is bounded by segment + pre-roll.
+    With tail_threshold_db set, rendering stops at the first segment past note_end_seconds
+    whose tail has decayed below it, and render_duration is only the cap.
+    """
+    fade = int(round(crossfade_seconds * SAMPLE_RATE))
+    pending = None  # The previous segment's held-back end
+    writer = None
+    peak = 0.0
+    start = 0.0
+    try:
+        while start < render_duration:
+            end = min(start + segment_seconds, render_duration)
+            overlap = 0 if pending is None else pending.shape[1]
+            segment_start = int(round(start * SAMPLE_RATE)) - overlap
+            audio, first = render_span(engine, synth, midi_events, ticks_per_beat, tempo_map,
+                                       segment_start / SAMPLE_RATE, end, preroll_seconds)
+            segment = audio[:, segment_start - first:]
+            if pending is not None:
+                segment[:, :overlap] = linear_crossfade(pending, segment)
+
+            decayed = False
+            if tail_threshold_db is not None and end > note_end_seconds:
+                keep_samples = max(0, int(round(note_end_seconds * SAMPLE_RATE)) - segment_start)
+                trimmed = trim_tail(segment, tail_threshold_db, keep_samples=keep_samples)
+                decayed = trimmed.shape[1] < segment.shape[1]
+                segment = trimmed
+            pending = None
+            if not decayed and end < render_duration and segment.shape[1] > fade:
+                pending = segment[:, -fade:].copy()
+                segment = segment[:, :-fade]
+
+            with TRACER.stage('wav_write', bytes=segment.nbytes, audio_seconds=segment.shape[1] / SAMPLE_RATE):
+                if writer is None:
+                    writer = WavStreamWriter(filename, SAMPLE_RATE, segment.shape[0])
+                writer.write(segment)
+            peak = max(peak, peak_abs(segment))
+            if decayed:
+                break
+            start = end
+    finally:
+        if writer is not None:
+            writer.close()
+    return peak
+
+def splice_region(stem, region, region_offset, start, fade_samples):
+    """Replace stem from sample start to the end of region, which begins at sample region_offset of the stem.
+
+    Both seams get an equal-power crossfade of fade_samples, placed before start (within
+    the region's pre-roll) and before the region's end. The stem grows if the region runs past it.
+    """
+    end = region_offset + region.shape[1]
+    if end > stem.shape[1]:
+        stem = np.pad(stem, ((0, 0), (0, end - stem.shape[1])))
+    fade_start = max(region_offset, start - fade_samples)
+    fade_end = max(start, end - fade_samples)
+    stem[:, fade_start:start] = equal_power_crossfade(stem[:, fade_start:start],
+                                                      region[:, fade_start - region_offset:])
+    stem[:, start:fade_end] = region[:, start - region_offset:fade_end - region_offset]
+    stem[:, fade_end:end] = equal_power_crossfade(region[:, fade_end - region_offset:], stem[:, fade_end:end])
+    return stem
+
+def render_track_region(engine, synth, midi_events, ticks_per_beat, tempo_map, start_tick, end_tick, stem,
+                        preroll_seconds=REGION_PREROLL_SECONDS, tail_seconds=REGION_TAIL_SECONDS,
+                        crossfade_seconds=CROSSFADE_SECONDS):
+    """Re-render [start_tick, end_tick) of a track plus a release tail and splice it into its old stem.
+
+    As for streamed segments, render_span starts preroll_seconds early so envelopes and
+    voices have settled by start_tick, and the pre-roll itself is thrown away.
+    """
+    start, end = ticks_to_seconds([start_tick, end_tick], tempo_map, ticks_per_beat)
+    region, first = render_span(engine, synth, midi_events, ticks_per_beat, tempo_map,
+                                max(0.0, start - crossfade_seconds), end + tail_seconds, preroll_seconds)
+    return splice_region(stem, region.astype(stem.dtype, copy=False), first, int(round(start * SAMPLE_RATE)),
+                         int(round(crossfade_seconds * SAMPLE_RATE)))
+
+def normalize_and_mix_stem_files(stem_files, gains, normalized_files, mixed_filename=None,
+                                 master_gain_db=0.0, limiter=False, block_seconds=30.0):
+    """Apply per-stem gains and sum the stems block by block from memory-mapped WAV files, returns the mix length"""
+    stems = [wavfile.read(filename, mmap=True)[1] for filename in stem_files]
+    num_channels = max((stem.shape[1] for stem in stems), default=2)
+    num_samples = max((stem.shape[0] for stem in stems), default=0)
+    block = int(block_seconds * SAMPLE_RATE)
+    master_gain = np.float32(10 ** (master_gain_db / 20))
+
+    # A None entry in normalized_files means that stem only goes into the mix
+    writers = [WavStreamWriter(filename, SAMPLE_RATE, stem.shape[1]) if filename else None
+               for filename, stem in zip(normalized_files, stems)]
+    mix_writer = WavStreamWriter(mixed_filename, SAMPLE_RATE, num_channels) if mixed_filename else None
+    written = sum(stem.shape[0] * stem.shape[1] * 4 for stem, writer in zip(stems, writers) if writer is not None)
+    if mix_writer is not None:
+        written += num_channels * num_samples * 4
+    mix_peak = 0.0
+    with TRACER.stage('normalize_mix', bytes=written, audio_seconds=num_samples / SAMPLE_RATE):
+        try:
+            for offset in range(0, num_samples, block):
+                mix = np.zeros((num_channels, min(block, num_samples - offset)), dtype=np.float32)
+                for stem, gain, writer in zip(stems, gains, writers):
+                    chunk = np.array(stem[offset:offset + block].T, dtype=np.float32)
+                    if chunk.shape[1] == 0:
+                        continue
+                    chunk *= np.float32(gain)
+                    if writer is not None:
+                        writer.write(chunk)
+                    mix[:chunk.shape[0], :chunk.shape[1]] += chunk
+                if mix_writer is not None:
+                    mix *= master_gain
+                    if limiter:
+                        soft_limit(mix)
+                    mix_writer.write(mix)
+                    mix_peak = max(mix_peak, peak_abs(mix))
+        finally:
+            for writer in writers:
+                if writer is not None:
+                    writer.close()
+            if mix_writer is not None:
+                mix_writer.close()
+    if mix_writer is not None:
+        report_mix_peak(mix_peak)
+    return num_samples
+
+def stem_cache_key(plugin_path, preset_path, events, tempo_map, sample_rate, buffer_size, render_duration,
+                   tail_threshold_db=None, backend='dawdreamer'):
+    """Hash everything that determines a rendered stem, events is the track's filter_event_array"""
+    digest = hashlib.sha256()
+    # The plugin binary's size and mtime too, so stems of an updated plugin aren't served
+    digest.update(plugin_state_key(plugin_path, preset_path).encode())
+    digest.update(np.ascontiguousarray(events, dtype=EVENT_DTYPE).tobytes())
+    for values in tempo_map:
+        digest.update(np.ascontiguousarray(values, dtype=np.float64).tobytes())
+    digest.update(repr((sample_rate, buffer_size, round(render_duration, 6), tail_threshold_db, backend)).encode())
+    return digest.hexdigest()
+
+class StemCache:
+    """Size-bounded LRU store of rendered stems keyed by stem_cache_key, recency is tracked by file mtime"""
+
+    def __init__(self, cache_dir=STEM_CACHE_DIR, max_bytes=STEM_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + '.npy')
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            audio = np.load(path)
+            os.utime(path)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return audio
+
+    def put(self, key, audio):
+        path = self._path(key)
+        temp_path = path + f'.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(temp_path, 'wb') as f:
+            np.save(f, audio)
+        os.replace(temp_path, path)
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.npy'):
+                try:
+                    stat = os.stat(os.path.join(self.cache_dir, name))
+                except FileNotFoundError:
+                    continue  # Evicted by another process sharing the cache
+                entries.append((stat.st_mtime, stat.st_size, name))
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        rate = self.hits / lookups * 100 if lookups else 0.0
+        return f"Stem cache: {self.hits} hits, {self.misses} misses ({rate:.0f}% hit rate)"
+
+class StemPipeline:
+    """Runs function(key, stem) for each rendered stem on background threads while the next one renders.
+
+    submit() blocks while max_pending jobs are queued or running, so rendering can't get
+    more than that many stems ahead of the disk. With threads=0 each job runs inside
+    submit(), which is the plain sequential pipeline.
+    """
+
+    def __init__(self, function, threads=0, max_pending=PIPELINE_MAX_PENDING):
+        self.function = function
+        self.executor = ThreadPoolExecutor(threads, thread_name_prefix='stem_io') if threads else None
+        self.slots = threading.BoundedSemaphore(max(max_pending, threads))
+        self.futures = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+
+    def submit(self, key, stem):
+        if self.executor is None:
+            future = Future()
+            future.set_result(self.function(key, stem))
+        else:
+            self.slots.acquire()
+            future = self.executor.submit(self.function, key, stem)
+            future.add_done_callback(lambda _: self.slots.release())
+        self.futures[key] = future
+
+    def results(self):
+        """Wait for every job, returns {key: result} and re-raises the first job's exception"""
+        return {key: future.result() for key, future in self.futures.items()}
+
+def track_db_value(track_name):
+    # Extract dB value from track name
+    db_value = extract_db_from_track_name(track_name)
+    if db_value is None:
+        db_value = -1  # Default to -1dB if no value found
+    return db_value
+
+def render_stem(engine, synth, midi_events, ticks_per_beat, render_duration, note_end_seconds=None,
+                tail_threshold_db=None, tempo_map=None, preroll_seconds=REGION_PREROLL_SECONDS,
+                crossfade_seconds=CROSSFADE_SECONDS):
+    """Render a track for render_duration, or with tail_threshold_db set, only until its release has decayed.
+
+    The adaptive path renders to note_end_seconds plus FIRST_TAIL_SECONDS. While the last
+    TAIL_BLOCK_SECONDS block is still above the threshold the tail is continued with
+    render_span, from preroll_seconds before the last note-off so the release plays out in
+    full, and linearly crossfaded on. Each continuation is twice as long as the one before,
+    so even a tail at the render_duration cap costs a handful of renders. DawDreamer can't
+    resume a render, and continuing from the note-off is far cheaper than re-rendering from zero.
+    """
+    send_midi_to_synth(synth, midi_events, ticks_per_beat)
+
+    graph = [(synth, [])]
+    engine.load_graph(graph)
+    if tail_threshold_db is None:
+        return render_audio(engine, render_duration)
+
+    keep_samples = int(round(note_end_seconds * SAMPLE_RATE))
+    block = int(TAIL_BLOCK_SECONDS * SAMPLE_RATE)
+    fade = int(round(crossfade_seconds * SAMPLE_RATE))
+    end = min(note_end_seconds + FIRST_TAIL_SECONDS, render_duration)
+    step = TAIL_BLOCK_SECONDS
+    audio = render_audio(engine, end)
+    while True:
+        trimmed = trim_tail(audio, tail_threshold_db, keep_samples=keep_samples)
+        # Shorter means the last whole block was quiet, without one there's nothing to judge yet
+        decayed = audio.shape[1] - keep_samples >= block and trimmed.shape[1] < audio.shape[1]
+        if decayed or end >= render_duration:
+            return trimmed
+        step *= 2
+        end = min(end + step, render_duration)
+        overlap = min(fade, audio.shape[1])
+        start = (audio.shape[1] - overlap) / SAMPLE_RATE
+        more, first = render_span(engine, synth, midi_events, ticks_per_beat, tempo_map, start, end,
+                                  preroll_seconds + max(0.0, start - note_end_seconds))
+        more = more[:, audio.shape[1] - overlap - first:]
+        more[:, :overlap] = linear_crossfade(audio[:, audio.shape[1] - overlap:], more)
+        audio = np.concatenate([audio[:, :audio.shape[1] - overlap], more], axis=1)
+
+RETAIN_CHOICES = ('none', 'raw', 'normalized', 'all')
+
+def stem_filename(stem_dir, midi_path, track_index, normalized=False):
+    """Deterministic stem name, prefixed with the song so songs sharing a directory don't collide"""
+    song_name = os.path.splitext(os.path.basename(midi_path))[0]
+    kind = 'normalized_track' if normalized else 'track'
+    return os.path.join(stem_dir, f'{song_name}_{kind}_{track_index}.wav')
+
+def load_song_config(config_path):
+    """Read a JSON or TOML song config into {track: (plugin, preset)}.
+
+    Tracks are keyed by MIDI track index or track name, under a "tracks" table or at the
+    top level. Each maps to [plugin, preset] or {plugin = ..., preset = ...}, where plugin
+    may name an entry of an optional "plugins" table. Relative paths are taken from the
+    config file's directory.
+    """
+    if config_path.endswith('.toml'):
+        if tomllib is None:
+            raise ImportError("TOML song configs need Python 3.11+ (tomllib), use JSON instead")
+        with open(config_path, 'rb') as f:
+            config = tomllib.load(f)
+    else:
+        with open(config_path) as f:
+            config = json.load(f)
+    tracks = config.get('tracks', config)
+    plugins = config.get('plugins', {}) if 'tracks' in config else {}
+    config_dir = os.path.dirname(os.path.abspath(config_path))
+
+    track_synths = {}
+    for track, synth in tracks.items():
+        plugin, preset = (synth['plugin'], synth['preset']) if isinstance(synth, dict) else synth
+        track_synths[track] = (os.path.join(config_dir, plugins.get(plugin, plugin)), os.path.join(config_dir, preset))
+    return track_synths
+
+def get_track_synths(track_synths=None, track_names=None):
+    """{track_index: (plugin, preset)}, by default TRACK_SYNTHS on tracks 1..7.
+
+    Keys that aren't indices are looked up in track_names, and dropped without them.
+    """
+    if track_synths is None:
+        return {i + 1: synth for i, synth in enumerate(TRACK_SYNTHS)}
+    resolved = {}
+    for track, synth in track_synths.items():
+        if isinstance(track, int) or track.isdigit():
+            resolved[int(track)] = tuple(synth)
+        elif track_names is not None and track in track_names:
+            resolved[track_names.index(track)] = tuple(synth)
+        elif track_names is not None:
+            print(f"Warning: No track named {track!r}, its synth is ignored.")
+    return resolved
+
+def max_buffer_size(max_block_ms=MAX_AUTOMATION_BLOCK_MS, sample_rate=SAMPLE_RATE):
+    """Largest candidate block size that keeps automation steps within max_block_ms"""
+    limit = sample_rate * max_block_ms / 1000
+    return max((size for size in BUFFER_SIZE_CANDIDATES if size <= limit), default=BUFFER_SIZE_CANDIDATES[0])
+
+def load_buffer_sizes(cache_path=BUFFER_SIZE_CACHE, max_block_ms=MAX_AUTOMATION_BLOCK_MS):
+    """{plugin: block size} from the tuning cache, capped by max_block_ms"""
+    limit = max_buffer_size(max_block_ms)
+    return {plugin: min(entry['buffer_size'], limit) for plugin, entry in load_manifest(cache_path).items()}
+
+def plugin_buffer_size(plugin_path, buffer_sizes=None):
+    return (buffer_sizes or {}).get(os.path.abspath(plugin_path), BUFFER_SIZE)
+
+def calibration_events(ticks_per_beat=PPQN, seconds=CALIBRATION_SECONDS):
+    """Triads on every eighth note at 120 BPM for seconds, enough polyphony to load a synth"""
+    track = MidiTrack()
+    chords = [(48, 52, 55), (45, 48, 52), (41, 45, 48), (43, 47, 50)]
+    step = ticks_per_beat // 2
+    for i in range(int(seconds * 4)):
+        chord = chords[(i // 8) % len(chords)]
+        for note in chord:
+            track.append(mido.Message('note_on', note=note, velocity=100, time=0))
+        for j, note in enumerate(chord):
+            track.append(mido.Message('note_off', note=note, velocity=0, time=step if j == 0 else 0))
+    return track
+
+def tune_buffer_sizes(track_synths=None, max_block_ms=MAX_AUTOMATION_BLOCK_MS, cache_path=BUFFER_SIZE_CACHE,
+                      backend='dawdreamer', repeats=2):
+    """Time a calibration clip through every configured plugin/preset at each allowed block size.
+
+    The block size with the lowest total render time over a plugin's presets is stored
+    per plugin in cache_path, which render_song picks up through load_buffer_sizes.
+    """
+    sizes = [size for size in BUFFER_SIZE_CANDIDATES if size <= max_buffer_size(max_block_ms)]
+    events = calibration_events()
+    timings = {}
+    synths = get_track_synths().values() if track_synths is None else [tuple(synth) for synth in track_synths.values()]
+    for plugin_path, preset_path in sorted(set(synths)):
+        plugin_timings = timings.setdefault(os.path.abspath(plugin_path), dict.fromkeys(sizes, 0.0))
+        for buffer_size in sizes:
+            engine = initialize_engine(SAMPLE_RATE, buffer_size, backend)
+            engine.set_bpm(120.0)
+            synth = create_synth(engine, plugin_path, preset_path, "calibration")
+            send_midi_to_synth(synth, events, PPQN)
+            engine.load_graph([(synth, [])])
+            seconds = []
+            for _ in range(repeats):
+                start = time.perf_counter()
+                render_audio(engine, CALIBRATION_SECONDS)
+                seconds.append(time.perf_counter() - start)
+            plugin_timings[buffer_size] += min(seconds)
+            print(f"{os.path.basename(plugin_path)} / {os.path.basename(preset_path)} @ {buffer_size}: "
+                  f"{CALIBRATION_SECONDS / min(seconds):.1f}x realtime")
+
+    tuned = load_manifest(cache_path)
+    for plugin_path, plugin_timings in timings.items():
+        best = min(plugin_timings, key=plugin_timings.get)
+        tuned[plugin_path] = {'buffer_size': best, 'seconds': {str(size): t for size, t in plugin_timings.items()}}
+        print(f"{os.path.basename(plugin_path)}: buffer size {best}")
+    save_manifest(tuned, cache_path)
+    return tuned
+
+def render_tracks(midi_path, track_indices, render_duration, segment_seconds=None, tail_threshold_db=None,
+                  max_tail_seconds=MAX_TAIL_SECONDS, track_synths=None, stem_dir='', backend='dawdreamer',
+                  buffer_sizes=None, regions=None, preroll_seconds=REGION_PREROLL_SECONDS,
+                  midi_cache_dir=MIDI_EVENT_CACHE_DIR, on_rendered=None):
+    """Render the given tracks one after another, returns {track_index: audio}.
+
+    Tracks share one engine per block size, buffer_sizes maps plugins to their tuned size.
+    With segment_seconds set the stems are streamed to disk instead and the result
+    is {track_index: (filename, peak)}. With tail_threshold_db set each track is rendered
+    to its own last note-off plus however much release is above the threshold, up to
+    max_tail_seconds, and render_duration is ignored.
+    regions maps tracks to (start_tick, end_tick, old stem filename): only that span is
+    rendered and spliced into the old stem, see render_track_region.
+    on_rendered(track_index, stem) takes each stem as soon as it's rendered, instead of the result.
+    """
+    regions = regions or {}
+    song = load_midi_events(midi_path, midi_cache_dir)
+    tempo_map = tempo_map_from_event_arrays(song.tracks)
+    if tail_threshold_db is not None:
+        render_duration = get_song_length_seconds(song, tempo_map) + max_tail_seconds
+    end_tick = int(np.ceil(seconds_to_ticks(render_duration, tempo_map, song.ticks_per_beat)))
+
+    track_synths = get_track_synths(track_synths, song.names)
+    engines = {}
+    # One instance per plugin binary and engine, the stems render one after another
+    # so each track just swaps its preset state into the shared instance
+    synths = {}
+    stems = {}
+    for track_index in track_indices:
+        plugin_path, preset_path = track_synths[track_index]
+        buffer_size = plugin_buffer_size(plugin_path, buffer_sizes)
+        if buffer_size not in engines:
+            engines[buffer_size] = initialize_engine(SAMPLE_RATE, buffer_size, backend)
+            set_engine_tempo(engines[buffer_size], tempo_map, song.ticks_per_beat, 0, end_tick)
+        engine = engines[buffer_size]
+        with TRACER.stage(f'track {track_index}'):
+            synth_key = (buffer_size, os.path.abspath(plugin_path))
+            if synth_key in synths:
+                with TRACER.stage('preset_load', preset=os.path.basename(preset_path)):
+                    load_preset_snapshot(synths[synth_key], plugin_path, preset_path)
+            else:
+                synths[synth_key] = create_synth(engine, plugin_path, preset_path, f"my_synth_{len(synths) + 1}")
+            stems[track_index] = _render_track(engine, synths[synth_key], song, tempo_map, track_index,
+                                               render_duration, segment_seconds, tail_threshold_db,
+                                               max_tail_seconds, midi_path, stem_dir,
+                                               regions.get(track_index), preroll_seconds)
+            if track_index in regions or tail_threshold_db is not None:
+                # Region renders and tail continuations re-time the engine to their own span
+                set_engine_tempo(engine, tempo_map, song.ticks_per_beat, 0, end_tick)
+        if on_rendered is not None:
+            on_rendered(track_index, stems.pop(track_index))
+    print(f"{len(track_indices)} tracks rendered on {len(synths)} plugin instances")
+    return stems
+
+def _render_track(engine, synth, song, tempo_map, track_index, render_duration, segment_seconds,
+                  tail_threshold_db, max_tail_seconds, midi_path, stem_dir, region=None,
+                  preroll_seconds=REGION_PREROLL_SECONDS):
+    """Render one track's stem through its loaded synth, in memory, streamed to disk or as a region splice"""
+    events = filter_event_array(song.tracks[track_index])
+    track_duration = render_duration
+    note_end_seconds = None
+    if tail_threshold_db is not None:
+        note_end_seconds = get_events_end_seconds(events, tempo_map, song.ticks_per_beat)
+        # Only the cap, render_stem and render_track_streaming stop once the tail has decayed
+        track_duration = note_end_seconds + max_tail_seconds
+    # The one conversion back to mido messages, for the hand-off to the synth
+    filtered_events = event_array_to_track(events)
+
+    if region is not None:
+        start_tick, end_tick, old_stem = region
+        stem = render_track_region(engine, synth, filtered_events, song.ticks_per_beat, tempo_map, start_tick,
+                                   end_tick, read_stem(old_stem), preroll_seconds)
+        if tail_threshold_db is not None:
+            stem = trim_tail(stem, tail_threshold_db, keep_samples=int(round(note_end_seconds * SAMPLE_RATE)))
+    elif segment_seconds:
+        filename = stem_filename(stem_dir, midi_path, track_index)
+        peak = render_track_streaming(engine, synth, filtered_events, song.ticks_per_beat, tempo_map,
+                                      track_duration, filename, segment_seconds, preroll_seconds,
+                                      note_end_seconds, tail_threshold_db)
+        stem = (filename, peak)
+    else:
+        stem = render_stem(engine, synth, filtered_events, song.ticks_per_beat, track_duration,
+                           note_end_seconds, tail_threshold_db, tempo_map, preroll_seconds)
+
+    print(f"synth_{track_index} num inputs: ", synth.get_num_input_channels())
+    print(f"synth_{track_index} num outputs: ", synth.get_num_output_channels())
+    return stem
+
+def render_tracks_parallel(midi_path, track_indices, render_duration, workers, segment_seconds=None,
+                           tail_threshold_db=None, max_tail_seconds=MAX_TAIL_SECONDS, track_synths=None, stem_dir='',
+                           backend='dawdreamer', buffer_sizes=None, regions=None,
+                           preroll_seconds=REGION_PREROLL_SECONDS, midi_cache_dir=MIDI_EVENT_CACHE_DIR):
+    """Spread the tracks over worker processes, each with its own engine"""
+    groups = [track_indices[w::workers] for w in range(workers)]
+    groups = [group for group in groups if group]
+
+    stems = {}
+    # Spawn rather than fork so each worker gets a clean plugin host
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=len(groups), mp_context=context) as executor:
+        futures = [executor.submit(_traced_call, TRACER.enabled, render_tracks, midi_path, group, render_duration,
+                                   segment_seconds, tail_threshold_db, max_tail_seconds, track_synths, stem_dir,
+                                   backend, buffer_sizes, regions, preroll_seconds, midi_cache_dir)
+                   for group in groups]
+        for future in futures:
+            group_stems, events = future.result()
+            stems.update(group_stems)
+            TRACER.events.extend(events)
+    return stems
+
+class RenderServer:
+    """Keeps one engine and its synths loaded between render jobs.
+
+    Jobs are JSON objects, one per line:
+        {"cmd": "render", "midi": path, "output_dir": dir, "tracks": {"1": [plugin, preset], ...}, "reset": false}
+        {"cmd": "reset"}
+        {"cmd": "shutdown"}
+    "tracks" defaults to TRACK_SYNTHS and may also be keyed by track name. Each job gets one JSON line back.
+    """
+
+    def __init__(self, sample_rate=SAMPLE_RATE, buffer_size=BUFFER_SIZE, backend='dawdreamer'):
+        self.engine = initialize_engine(sample_rate, buffer_size, backend)
+        self.sample_rate = sample_rate
+        self.synths = {}
+
+    def get_synth(self, plugin_path, preset_path):
+        key = (plugin_path, preset_path)
+        if key not in self.synths:
+            self.synths[key] = create_synth(self.engine, plugin_path, preset_path, f"synth_{len(self.synths) + 1}")
+        return self.synths[key]
+
+    def reset(self):
+        """Put every resident synth back to its preset, dropping parameter changes and MIDI from earlier jobs"""
+        for (plugin_path, preset_path), synth in self.synths.items():
+            synth.clear_midi()
+            load_preset_snapshot(synth, plugin_path, preset_path)
+
+    def render(self, job):
+        start = time.perf_counter()
+        if job.get('reset'):
+            self.reset()
+
+        song = load_midi_events(job['midi'])
+        track_synths = get_track_synths(job.get('tracks'), song.names)
+
+        tempo_map = tempo_map_from_event_arrays(song.tracks)
+        render_duration = job.get('render_duration', get_song_length_seconds(song, tempo_map) + RELEASE_TAIL_SECONDS)
+        end_tick = int(np.ceil(seconds_to_ticks(render_duration, tempo_map, song.ticks_per_beat)))
+        set_engine_tempo(self.engine, tempo_map, song.ticks_per_beat, 0, end_tick)
+
+        output_dir = job.get('output_dir', '.')
+        os.makedirs(output_dir, exist_ok=True)
+        stem_files = {}
+        for track_index, (plugin_path, preset_path) in sorted(track_synths.items()):
+            if track_index >= len(song.tracks):
+                continue
+            synth = self.get_synth(plugin_path, preset_path)
+            audio = render_stem(self.engine, synth, get_track_events(song, track_index),
+                                song.ticks_per_beat, render_duration)
+            filename = stem_filename(output_dir, job['midi'], track_index)
+            save_audio(filename, self.sample_rate, audio)
+            stem_files[str(track_index)] = filename
+
+        return {'ok': True, 'stems': stem_files, 'seconds': time.perf_counter() - start}
+
+    def handle(self, line):
+        """Run one JSON job line, returns (response, keep_running)"""
+        try:
+            job = json.loads(line)
+            cmd = job.get('cmd', 'render')
+            if cmd == 'shutdown':
+                return {'ok': True}, False
+            if cmd == 'reset':
+                self.reset()
+                return {'ok': True}, True
+            if cmd == 'render':
+                return self.render(job), True
+            return {'ok': False, 'error': f"Unknown command: {cmd}"}, True
+        except Exception as e:
+            return {'ok': False, 'error': f"{type(e).__name__}: {e}"}, True
+
+    def serve_stdin(self):
+        for line in sys.stdin:
+            if not line.strip():
+                continue
+            # stdout carries only the JSON responses, warnings printed during a job go to stderr
+            with contextlib.redirect_stdout(sys.stderr):
+                response, keep_running = self.handle(line)
+            print(json.dumps(response), flush=True)
+            if not keep_running:
+                break
+
+    def serve_socket(self, socket_path):
+        import socketserver
+
+        server = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for line in self.rfile:
+                    if not line.strip():
+                        continue
+                    response, keep_running = server.handle(line)
+                    self.wfile.write((json.dumps(response) + '\n').encode())
+                    if not keep_running:
+                        # shutdown() blocks until serve_forever returns, so call it off this thread
+                        threading.Thread(target=unix_server.shutdown).start()
+                        return
+
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        # One job at a time, the engine isn't shared between threads
+        with socketserver.UnixStreamServer(socket_path, Handler) as unix_server:
+            unix_server.serve_forever()
+        os.remove(socket_path)
+
+def render_song(midi_path, mixed_filename, track_synths=None, workers=1, mixer='numpy', master_gain_db=0.0,
+                limiter=True, segment_seconds=None, cache_dir=STEM_CACHE_DIR, cache_max_bytes=STEM_CACHE_MAX_BYTES,
+                tail_threshold_db=TAIL_THRESHOLD_DB, max_tail_seconds=MAX_TAIL_SECONDS, reapeaks=False,
+                retain='none', backend='dawdreamer', buffer_sizes=None, incremental=False, region_render=False,
+                preroll_seconds=REGION_PREROLL_SECONDS, io_threads=0, midi_cache_dir=MIDI_EVENT_CACHE_DIR):
+    """Render, normalize and mix one MIDI file, returns the length of the mix in seconds.
+
+    The mix goes through master_gain_db and then, unless limiter is off, soft_limit, so by
+    default the master never clips.
+    retain picks which intermediate stems end up next to mixed_filename: 'none', 'raw',
+    'normalized' or 'all'. Stems that aren't kept stay in memory where the mode allows it.
+    With reapeaks every kept WAV and the mix get REAPER peak files in peaks/.
+    backend 'numpy' renders every track with NumpySynth instead of its plugin.
+    buffer_sizes maps plugins to tuned block sizes, see load_buffer_sizes.
+    With incremental the raw stems are kept and <mix>.render_state.json records each track's
+    stem key, the next run only renders tracks whose events, synth or tempo changed.
+    region_render (with incremental, not streaming) also keeps each track's events in
+    <mix>.render_state.npz, and a track whose events alone changed over a short span only
+    has that span re-rendered, from preroll_seconds before it, and spliced into its old stem.
+    Streamed segments are rendered after the same pre-roll.
+    With io_threads set, in-memory stems are written and normalized on that many background
+    threads while the next track renders, see StemPipeline.
+    midi_cache_dir is where parsed MIDI is cached, None parses the file every time.
+    """
+    with TRACER.stage('midi_load'):
+        song = load_midi_events(midi_path, midi_cache_dir)
+    track_synths = get_track_synths(track_synths, song.names)
+    stem_dir = os.path.dirname(mixed_filename)
     individual_audio_files = []
     norm_audio_files = []
+    norm_stems = []
 
-    # Extract tempo from Track 0 of the MIDI file
-    midi = MidiFile(MIDI_PATH)
-    tempo = extract_tempo_from_track_0(midi.tracks[0])
-    if tempo:
-        # Convert tempo to BPM
-        bpm = 120000000 / tempo
-        # Set the BPM in the engine
-        engine.set_bpm(bpm)
+    # Collect every tempo change of the MIDI file
+    tempo_map = tempo_map_from_event_arrays(song.tracks)
 
     # Calculate the longest track length in seconds
-    longest_track_length_seconds = get_longest_track_length_seconds(midi)
-    render_duration = longest_track_length_seconds + 2
-
-    for i, synth in enumerate(synths):
-        track_index = i + 1  # Start from Track 1
-        if track_index < len(midi_tracks):
-            filtered_events = filter_midi_events(midi_tracks[track_index])
-            temp_midi_path = assign_midi_to_synth(synth, filtered_events)
-            temp_midi_files.append(temp_midi_path)
-            
-            # Render individual audio track
-            graph = [(synth, [])]
-            engine.load_graph(graph)
-            audio = render_audio(engine, render_duration)
-            individual_filename = f'track_{track_index}_{time.time()}.wav'
-            save_audio(individual_filename, SAMPLE_RATE, audio)
-            individual_audio_files.append(individual_filename)
+    longest_track_length_seconds = get_song_length_seconds(song, tempo_map)
+    render_duration = longest_track_length_seconds + RELEASE_TAIL_SECONDS
+
+    track_indices = sorted(i for i in track_synths if 0 < i < len(song.tracks))  # Start from Track 1
+
+    state_path = os.path.splitext(mixed_filename)[0] + '.render_state.json'
+    render_state = load_manifest(state_path).get('tracks', {}) if incremental else {}
+    if incremental:
+        # The state points at the raw stems, so they have to stay on disk
+        retain = {'none': 'raw', 'normalized': 'all'}.get(retain, retain)
+    events_path = os.path.splitext(mixed_filename)[0] + '.render_state.npz'
+    region_render = region_render and incremental and not segment_seconds
+    old_events = {}
+    if region_render and os.path.exists(events_path):
+        with np.load(events_path) as saved:
+            old_events = {name: saved[name] for name in saved.files}
+
+    # Reuse stems whose plugin, preset, events and render settings haven't changed
+    stems = {}
+    cache_keys = {}
+    region_keys = {}
+    track_events = {}
+    track_durations = {}
+    regions = {}
+    reused = set()
+    cache = StemCache(cache_dir, cache_max_bytes) if cache_dir and not segment_seconds else None
+    if cache is not None or incremental:
+        for track_index in track_indices:
+            plugin_path, preset_path = track_synths[track_index]
+            events = track_events[track_index] = filter_event_array(song.tracks[track_index])
+            track_duration = render_duration
+            if tail_threshold_db is not None:
+                # Adaptive tails only depend on the track itself, not on the longest track
+                track_duration = get_events_end_seconds(events, tempo_map, song.ticks_per_beat) + max_tail_seconds
+            buffer_size = plugin_buffer_size(plugin_path, buffer_sizes)
+            cache_keys[track_index] = stem_cache_key(plugin_path, preset_path, events, tempo_map,
+                                                     SAMPLE_RATE, buffer_size, track_duration, tail_threshold_db,
+                                                     backend)
+            # Everything but the events and the length, a region render needs this part unchanged
+            region_keys[track_index] = stem_cache_key(plugin_path, preset_path, events[:0], tempo_map, SAMPLE_RATE,
+                                                      buffer_size, 0.0, tail_threshold_db, backend)
+            track_durations[track_index] = round(track_duration, 6)
+            entry = render_state.get(str(track_index), {})
+            if (entry.get('key') == cache_keys[track_index] and entry.get('segment_seconds') == segment_seconds
+                    and os.path.exists(entry['stem'])):
+                stems[track_index] = (entry['stem'], entry['peak']) if segment_seconds else read_stem(entry['stem'])
+                reused.add(track_index)
+                continue
+            audio = cache.get(cache_keys[track_index]) if cache is not None else None
+            if audio is not None:
+                stems[track_index] = audio
+            elif (region_render and entry.get('region_key') == region_keys[track_index]
+                    and f'track_{track_index}' in old_events and os.path.exists(entry['stem'])
+                    # Fixed-length stems must keep their length, adaptive tails are trimmed again
+                    and (tail_threshold_db is not None or entry.get('duration') == track_durations[track_index])):
+                changed = changed_tick_range(old_events[f'track_{track_index}'], events, song.ticks_per_beat)
+                if changed is not None:
+                    start, end = ticks_to_seconds(changed, tempo_map, song.ticks_per_beat)
+                    span = end + REGION_TAIL_SECONDS - max(0.0, start - preroll_seconds)
+                    if span < REGION_MAX_FRACTION * track_duration:
+                        regions[track_index] = (*changed, entry['stem'])
+    to_render = [track_index for track_index in track_indices if track_index not in stems]
+    if incremental:
+        print(f"{len(reused)} unchanged tracks reused, {len(to_render)} to render")
+    for track_index, (start_tick, end_tick, _) in sorted(regions.items()):
+        print(f"Track {track_index}: re-rendering ticks {start_tick}-{end_tick} into its previous stem")
+
+    keep_raw = retain in ('raw', 'all')
+    keep_normalized = retain in ('normalized', 'all')
+    # ffmpeg can only mix files, so it needs the normalized stems on disk either way
+    write_normalized = keep_normalized or mixer == 'ffmpeg'
+    # A splice sounds like the full render but isn't bit-identical, keep it out of the shared cache
+    to_cache = set(to_render) - set(regions) if cache is not None else set()
+
+    def post_process(track_index, audio):
+        """Cache, write and normalize one in-memory stem, returns (raw file, normalized file, normalized audio)"""
+        if track_index in to_cache:
+            cache.put(cache_keys[track_index], audio)
+        individual_filename = None
+        if keep_raw:
+            individual_filename = stem_filename(stem_dir, midi_path, track_index)
+            if track_index not in reused:
+                save_audio(individual_filename, SAMPLE_RATE, audio)
+            if reapeaks:
+                write_reapeaks(individual_filename, audio, SAMPLE_RATE)
+
+        db_value = track_db_value(song.names[track_index])
 
-            # Extract dB value from track name
-            track_name = midi_tracks[track_index].name
-            db_value = extract_db_from_track_name(track_name)
-            if db_value is None:
-                db_value = -1  # Default to -1dB if no value found
+        # Normalize audio to the extracted dB value, in place: the raw stem is no longer needed
+        normalized_audio = normalize_in_place(audio, db_value)
+        if normalized_audio is None:
+            print(f"Warning: Max absolute value of audio is zero for track {track_index}. Skipping normalization.")
+            normalized_audio = audio  # or handle it in another way
 
-            # Normalize audio to the extracted dB value
-            max_abs_audio = np.max(np.abs(audio))
-            if max_abs_audio == 0:
+        normalized_filename = None
+        if write_normalized:
+            normalized_filename = stem_filename(stem_dir, midi_path, track_index, normalized=True)
+            save_audio(normalized_filename, SAMPLE_RATE, normalized_audio)
+            if reapeaks and keep_normalized:
+                write_reapeaks(normalized_filename, normalized_audio, SAMPLE_RATE)
+        return individual_filename, normalized_filename, normalized_audio
+
+    with StemPipeline(post_process, io_threads) as pipeline:
+        if not segment_seconds:
+            # Stems that needn't be rendered go first, each rendered one as soon as it's done
+            for track_index in track_indices:
+                if track_index in stems:
+                    pipeline.submit(track_index, stems.pop(track_index))
+
+        if to_render and workers > 1:
+            rendered = render_tracks_parallel(midi_path, to_render, render_duration, workers, segment_seconds,
+                                              tail_threshold_db, max_tail_seconds, track_synths, stem_dir, backend,
+                                              buffer_sizes, regions, preroll_seconds, midi_cache_dir)
+        elif to_render:
+            rendered = render_tracks(midi_path, to_render, render_duration, segment_seconds,
+                                     tail_threshold_db, max_tail_seconds, track_synths, stem_dir, backend,
+                                     buffer_sizes, regions, preroll_seconds, midi_cache_dir,
+                                     on_rendered=None if segment_seconds else pipeline.submit)
+        else:
+            rendered = {}
+        if not segment_seconds:
+            for track_index in sorted(rendered):
+                pipeline.submit(track_index, rendered.pop(track_index))
+            post_processed = pipeline.results()
+        stems.update(rendered)
+
+    if cache is not None:
+        print(cache.stats())
+
+    if incremental:
+        render_state = {}
+        for track_index in track_indices:
+            render_state[str(track_index)] = {
+                'key': cache_keys[track_index],
+                'stem': os.path.abspath(stem_filename(stem_dir, midi_path, track_index)),
+                'peak': stems[track_index][1] if segment_seconds else None,
+                'segment_seconds': segment_seconds,
+                'region_key': region_keys[track_index],
+                'duration': track_durations[track_index],
+            }
+
+    if segment_seconds:
+        # Streaming mode: stems are already on disk, normalize and mix them block by block
+        gains = []
+        for track_index in track_indices:
+            individual_filename, peak = stems[track_index]
+            individual_audio_files.append(individual_filename)
+            norm_audio_files.append(stem_filename(stem_dir, midi_path, track_index, normalized=True)
+                                    if write_normalized else None)
+            if peak == 0:
                 print(f"Warning: Max absolute value of audio is zero for track {track_index}. Skipping normalization.")
-                normalized_audio = audio  # or handle it in another way
+                gains.append(1.0)
             else:
-                normalized_audio = audio / max_abs_audio * 10 ** (db_value / 20)
+                gains.append(10 ** (track_db_value(song.names[track_index]) / 20) / peak)
 
-            # Save normalized audio
-            normalized_filename = f'normalized_track_{track_index}_{time.time()}.wav'
-            save_audio(normalized_filename, SAMPLE_RATE, normalized_audio)
-            norm_audio_files.append(normalized_filename)
-            
-            print(f"synth_{i+1} num inputs: ", synth.get_num_input_channels())
-            print(f"synth_{i+1} num outputs: ", synth.get_num_output_channels())
-    
-    # Mix individual audio files into one using FFMPEG
-    mixed_filename = 'mixed_' + str(time.time()) + '.wav'
-    mix_audio_files_with_ffmpeg(norm_audio_files, mixed_filename)
+        mix_samples = normalize_and_mix_stem_files(individual_audio_files, gains, norm_audio_files,
+                                                   None if mixer == 'ffmpeg' else mixed_filename,
+                                                   master_gain_db, limiter, segment_seconds)
+        if reapeaks:
+            kept_files = (individual_audio_files if keep_raw else []) + (norm_audio_files if keep_normalized else [])
+            if mixer != 'ffmpeg':
+                kept_files.append(mixed_filename)
+            for filename in kept_files:
+                write_reapeaks(filename, wavfile.read(filename, mmap=True)[1].T, SAMPLE_RATE)
+    else:
+        # Collect in track order so serial, pipelined and parallel runs produce the same files
+        for track_index in track_indices:
+            individual_filename, normalized_filename, normalized_audio = post_processed.pop(track_index)
+            if individual_filename:
+                individual_audio_files.append(individual_filename)
+            if normalized_filename:
+                norm_audio_files.append(normalized_filename)
+            norm_stems.append(normalized_audio)
+
+        mix_samples = max((stem.shape[1] for stem in norm_stems), default=0)
+        if mixer != 'ffmpeg':
+            mix = mix_stems(norm_stems, master_gain_db=master_gain_db, limiter=limiter)
+            save_audio(mixed_filename, SAMPLE_RATE, mix)
+            if reapeaks:
+                write_reapeaks(mixed_filename, mix, SAMPLE_RATE)
+
+    if mixer == 'ffmpeg':
+        # Mix individual audio files into one using FFMPEG
+        mix_audio_files_with_ffmpeg(norm_audio_files, mixed_filename)
     print(f"Mixed audio saved to {mixed_filename}")
-    
-    # Delete temporary MIDI files
-    for temp_midi_path in temp_midi_files:
-        if os.path.exists(temp_midi_path):
-            os.remove(temp_midi_path)
-            print(f"Deleted temporary file: {temp_midi_path}")
-    
-    # Optionally delete individual audio files
-    for individual_filename in individual_audio_files:
-        if os.path.exists(individual_filename):
-            os.remove(individual_filename)
-            print(f"Deleted individual audio file: {individual_filename}")
-
-    # Optionally delete normalized audio files
-    for normalized_filename in norm_audio_files:
-        if os.path.exists(normalized_filename):
-            os.remove(normalized_filename)
-            print(f"Deleted normalized audio file: {normalized_filename}")
+
+    # Delete the intermediates the retention policy doesn't ask for
+    for filename in (individual_audio_files if not keep_raw else []) + (norm_audio_files if not keep_normalized else []):
+        if filename and os.path.exists(filename):
+            os.remove(filename)
+
+    if incremental:
+        # Written last, so an interrupted run never points at stems that weren't finished
+        if region_render:
+            temp_path = events_path + f'.{os.getpid()}.tmp.npz'
+            np.savez(temp_path, **{f'track_{track_index}': track_events[track_index]
+                                   for track_index in track_indices})
+            os.replace(temp_path, events_path)
+        save_manifest({'midi': os.path.abspath(midi_path), 'tracks': render_state}, state_path)
+
+    return mix_samples / SAMPLE_RATE
+
+def render_preview(midi_path, preview_filename, bars=None, skip_tracks=(), track_synths=None,
+                   sample_rate=PREVIEW_SAMPLE_RATE, buffer_size=PREVIEW_BUFFER_SIZE, output_sample_rate=SAMPLE_RATE,
+                   backend='dawdreamer'):
+    """Draft render for arrangement checks, returns the preview's length in seconds.
+
+    Renders at sample_rate with buffer_size blocks, only bars (first, last) if given and
+    without skip_tracks, then resamples the mix to output_sample_rate. Stems stay in memory
+    and the stem cache is never read or written, so previews can't leak into final renders.
+    """
+    song = load_midi_events(midi_path)
+    ticks_per_beat = song.ticks_per_beat
+    tempo_map = tempo_map_from_event_arrays(song.tracks)
+    if bars:
+        time_signatures = extract_time_signatures(MidiFile(midi_path))
+        start_tick, end_tick = (int(tick) for tick in bars_to_ticks([bars[0], bars[1] + 1], time_signatures, ticks_per_beat))
+    else:
+        start_tick = 0
+        end_tick = int(np.ceil(seconds_to_ticks(get_song_length_seconds(song, tempo_map), tempo_map, ticks_per_beat)))
+    start_seconds, end_seconds = ticks_to_seconds([start_tick, end_tick], tempo_map, ticks_per_beat)
+    render_duration = float(end_seconds - start_seconds) + PREVIEW_TAIL_SECONDS
+
+    engine = initialize_engine(sample_rate, buffer_size, backend)
+    tail_tick = int(np.ceil(seconds_to_ticks(end_seconds + PREVIEW_TAIL_SECONDS, tempo_map, ticks_per_beat)))
+    set_engine_tempo(engine, tempo_map, ticks_per_beat, start_tick, tail_tick)
+
+    stems = []
+    for track_index, (plugin_path, preset_path) in sorted(get_track_synths(track_synths, song.names).items()):
+        if not 0 < track_index < len(song.tracks) or track_index in skip_tracks:
+            continue
+        synth = create_synth(engine, plugin_path, preset_path, f"preview_synth_{track_index}")
+        events = slice_midi_events(get_track_events(song, track_index), start_tick, end_tick)
+        audio = render_stem(engine, synth, events, ticks_per_beat, render_duration)
+        normalized_audio = normalize_in_place(audio, track_db_value(song.names[track_index]))
+        if normalized_audio is not None:
+            stems.append(normalized_audio)
+
+    mix = mix_stems(stems)
+    if output_sample_rate != sample_rate:
+        divisor = math.gcd(output_sample_rate, sample_rate)
+        mix = resample_poly(mix, output_sample_rate // divisor, sample_rate // divisor, axis=1).astype(np.float32)
+    save_audio(preview_filename, output_sample_rate, mix)
+    print(f"Preview saved to {preview_filename}")
+    return mix.shape[1] / output_sample_rate
+
+def main(midi_path=MIDI_PATH, **kwargs):
+    song_name = os.path.splitext(os.path.basename(midi_path))[0]
+    render_song(midi_path, f'mixed_{song_name}.wav', **kwargs)
+
+def load_manifest(manifest_path):
+    try:
+        with open(manifest_path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_manifest(manifest, manifest_path):
+    # Write then rename so a crash mid-write can't lose the progress recorded so far
+    temp_path = manifest_path + '.tmp'
+    with open(temp_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(temp_path, manifest_path)
+
+def _render_batch_song(midi_path, mixed_filename, track_synths, render_options):
+    start = time.perf_counter()
+    with TRACER.stage('song', midi=os.path.basename(midi_path)):
+        audio_seconds = render_song(midi_path, mixed_filename, track_synths, **render_options)
+    return audio_seconds, time.perf_counter() - start
+
+def render_batch(pattern, output_dir, track_synths=None, workers=1, manifest_path=None, **render_options):
+    """Render every MIDI file matching pattern into output_dir, one song per worker process.
+
+    Finished songs are recorded in a JSON manifest with the hash of the MIDI they came from,
+    so a rerun after an interruption skips everything already done and unchanged.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = manifest_path or os.path.join(output_dir, 'batch_manifest.json')
+    manifest = load_manifest(manifest_path)
+
+    # pattern may also be a list of paths, e.g. from select_from_catalog
+    midi_paths = [os.path.abspath(midi_path) for midi_path in
+                  (pattern if isinstance(pattern, list) else find_midi_files(pattern))]
+    # Mirror the library's folders under output_dir so equal file names can't collide
+    root = os.path.commonpath([os.path.dirname(midi_path) for midi_path in midi_paths]) if midi_paths else ''
+    jobs = []
+    for key in midi_paths:
+        entry = manifest.get(key, {})
+        file_hash = file_sha256(key)
+        if entry.get('status') == 'done' and entry.get('hash') == file_hash and os.path.exists(entry['output']):
+            continue
+        # Absolute like the keys, so a rerun from another directory still finds the finished songs
+        output = os.path.abspath(os.path.join(output_dir, os.path.splitext(os.path.relpath(key, root))[0] + '.wav'))
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+        jobs.append((key, file_hash, output))
+    print(f"{len(jobs)} songs to render, {len(midi_paths) - len(jobs)} already done")
+
+    start = time.perf_counter()
+    audio_seconds = 0.0
+    done = 0
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=max(1, workers), mp_context=context) as executor:
+        futures = {executor.submit(_traced_call, TRACER.enabled, _render_batch_song, key, output, track_synths,
+                                   render_options): (key, file_hash, output)
+                   for key, file_hash, output in jobs}
+        for future in as_completed(futures):
+            key, file_hash, output = futures[future]
+            try:
+                (song_seconds, render_seconds), events = future.result()
+                TRACER.events.extend(events)
+            except Exception as e:
+                manifest[key] = {'status': 'failed', 'hash': file_hash, 'error': f"{type(e).__name__}: {e}"}
+                print(f"Failed {key}: {e}")
+            else:
+                manifest[key] = {'status': 'done', 'hash': file_hash, 'output': output,
+                                 'audio_seconds': song_seconds, 'render_seconds': render_seconds}
+                audio_seconds += song_seconds
+                done += 1
+            save_manifest(manifest, manifest_path)
+
+    elapsed = time.perf_counter() - start
+    if done:
+        print(f"Rendered {done} songs in {elapsed:.1f}s: {done / elapsed * 60:.2f} songs/min, "
+              f"{audio_seconds / elapsed:.2f}x realtime")
+
+def build_parser(prog=None):
+    parser = argparse.ArgumentParser(prog=prog, description="Render the MIDI tracks through their synths and mix them down")
+    parser.add_argument('--midi', default=MIDI_PATH,
+                        help="MIDI file to render, defaults to MIDI_PATH")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="Number of render processes, 1 renders serially on one engine")
+    parser.add_argument('--mixer', choices=['numpy', 'ffmpeg'], default='numpy',
+                        help="Mix the stems in-process or through the legacy ffmpeg amix call")
+    parser.add_argument('--master-gain-db', type=float, default=0.0,
+                        help="Gain applied to the summed mix (numpy mixer only)")
+    parser.add_argument('--limiter', action='store_true', default=True,
+                        help="Soft-limit the mix below full scale, the default (numpy mixer only)")
+    parser.add_argument('--no-limiter', dest='limiter', action='store_false',
+                        help="Leave the mix unlimited, peaks over full scale clip")
+    parser.add_argument('--segment-seconds', type=float, default=None,
+                        help="Stream each stem to disk in segments of this length to bound memory on long songs")
+    parser.add_argument('--cache-dir', default=STEM_CACHE_DIR,
+                        help="Directory of the rendered stem cache")
+    parser.add_argument('--cache-max-mb', type=float, default=STEM_CACHE_MAX_BYTES / 1024 ** 2,
+                        help="Least recently used stems are evicted above this size")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="Always render every stem")
+    parser.add_argument('--serve', action='store_true',
+                        help="Keep the synths loaded and take JSON render jobs on stdin, one per line")
+    parser.add_argument('--socket', default=None,
+                        help="With --serve, listen on this Unix socket instead of stdin")
+    parser.add_argument('--fixed-tail', action='store_true',
+                        help=f"Render every track to the longest track plus {RELEASE_TAIL_SECONDS}s instead of detecting each tail")
+    parser.add_argument('--tail-threshold-db', type=float, default=TAIL_THRESHOLD_DB,
+                        help="RMS level below which a track's release counts as finished")
+    parser.add_argument('--max-tail-seconds', type=float, default=MAX_TAIL_SECONDS,
+                        help="Longest release rendered after a track's last note-off")
+    parser.add_argument('--batch', default=None,
+                        help="Render every .mid in this directory, or matching this glob, instead of --midi")
+    parser.add_argument('--output-dir', default='renders',
+                        help="Where --batch writes one mix per song and its progress manifest")
+    parser.add_argument('--track-map', '--config', default=None,
+                        help='JSON or TOML song config mapping track index or name to plugin + preset, '
+                             'e.g. {"1": ["blocks.vst3", "clappy.vstpreset"]}')
+    parser.add_argument('--where', default=None,
+                        help="Batch-render the catalog's files matching this SQL condition on files f and tracks t "
+                             "instead of --batch, e.g. \"f.duration_seconds < 120\"")
+    parser.add_argument('--catalog', default=CATALOG_PATH,
+                        help="SQLite MIDI catalog for --where, built with cli.py index")
+    parser.add_argument('--manifest', default=None,
+                        help="Progress manifest for --batch, defaults to batch_manifest.json in --output-dir")
+    parser.add_argument('--retain', choices=RETAIN_CHOICES, default='none',
+                        help="Intermediate stems to keep on disk, the rest stay in memory")
+    parser.add_argument('--incremental', action='store_true',
+                        help="Keep the raw stems and a render state file, later runs only render the tracks that changed")
+    parser.add_argument('--region-render', action='store_true',
+                        help="With --incremental, re-render only the edited span of a changed track and splice it in")
+    parser.add_argument('--preroll-seconds', type=float, default=REGION_PREROLL_SECONDS,
+                        help="MIDI rendered ahead of each --segment-seconds segment and --region-render span "
+                             "to settle envelopes and voices")
+    parser.add_argument('--io-threads', type=int, default=0,
+                        help="Write and normalize each stem on this many background threads while the next one renders")
+    parser.add_argument('--reapeaks', action='store_true',
+                        help="Write REAPER .reapeaks files for the mix and every retained stem")
+    parser.add_argument('--trace', default=None,
+                        help="Write per-stage timings to this Chrome trace-event JSON file and print a summary")
+    parser.add_argument('--backend', choices=RENDER_BACKENDS, default='dawdreamer',
+                        help="Render through the plugins with DawDreamer, or with the built-in NumPy synth for previews")
+    parser.add_argument('--preview', action='store_true',
+                        help="Quick draft render to preview_<song>.wav at a reduced sample rate, never cached")
+    parser.add_argument('--bars', default=None,
+                        help="With --preview, render only this bar range, e.g. 9-16")
+    parser.add_argument('--skip-tracks', type=int, nargs='+', default=[],
+                        help="With --preview, leave these track indices out")
+    parser.add_argument('--preview-sample-rate', type=int, default=PREVIEW_SAMPLE_RATE,
+                        help="Internal sample rate of --preview, the file is resampled to the full rate")
+    parser.add_argument('--preview-buffer-size', type=int, default=PREVIEW_BUFFER_SIZE)
+    parser.add_argument('--tune-buffer-sizes', action='store_true',
+                        help=f"Time each configured plugin at {BUFFER_SIZE_CANDIDATES} and store its fastest block size")
+    parser.add_argument('--max-block-ms', type=float, default=MAX_AUTOMATION_BLOCK_MS,
+                        help="Longest block, and so coarsest automation step, a tuned buffer size may use")
+    parser.add_argument('--buffer-size-cache', default=BUFFER_SIZE_CACHE,
+                        help="Tuned block sizes per plugin, written by --tune-buffer-sizes")
+    return parser
+
+def run(argv=None, prog=None):
+    """Command line entry point, argv defaults to sys.argv[1:]"""
+    parser = build_parser(prog)
+    args = parser.parse_args(argv)
+    if (args.bars or args.skip_tracks) and not args.preview:
+        parser.error("--bars and --skip-tracks only apply to --preview renders")
+    if args.region_render and not args.incremental:
+        parser.error("--region-render needs the stems and state kept by --incremental")
+    if args.trace:
+        enable_tracing()
+    if args.serve:
+        render_server = RenderServer(backend=args.backend)
+        if args.socket:
+            render_server.serve_socket(args.socket)
+        else:
+            render_server.serve_stdin()
+        return
+    track_synths = None
+    if args.track_map:
+        track_synths = load_song_config(args.track_map)
+    if args.tune_buffer_sizes:
+        tune_buffer_sizes(track_synths, args.max_block_ms, args.buffer_size_cache, args.backend)
+        return
+    render_options = dict(mixer=args.mixer, master_gain_db=args.master_gain_db, limiter=args.limiter,
+                          segment_seconds=args.segment_seconds, cache_dir=None if args.no_cache else args.cache_dir,
+                          cache_max_bytes=int(args.cache_max_mb * 1024 ** 2),
+                          tail_threshold_db=None if args.fixed_tail else args.tail_threshold_db,
+                          max_tail_seconds=args.max_tail_seconds, reapeaks=args.reapeaks,
+                          retain=args.retain, backend=args.backend,
+                          buffer_sizes=load_buffer_sizes(args.buffer_size_cache, args.max_block_ms),
+                          incremental=args.incremental, region_render=args.region_render,
+                          preroll_seconds=args.preroll_seconds, io_threads=max(0, args.io_threads))
+    if args.preview:
+        start = time.perf_counter()
+        song_name = os.path.splitext(os.path.basename(args.midi))[0]
+        preview_seconds = render_preview(args.midi, f'preview_{song_name}.wav',
+                                         parse_bar_range(args.bars) if args.bars else None, set(args.skip_tracks),
+                                         track_synths, args.preview_sample_rate, args.preview_buffer_size,
+                                         backend=args.backend)
+        print(f"{preview_seconds:.1f}s preview in {time.perf_counter() - start:.1f}s")
+    elif args.batch or args.where:
+        # Songs are spread over the workers, each song renders serially inside its worker
+        pattern = select_from_catalog(args.where, db_path=args.catalog) if args.where else args.batch
+        render_batch(pattern, args.output_dir, track_synths, workers=max(1, args.workers),
+                     manifest_path=args.manifest, **render_options)
+    else:
+        main(args.midi, track_synths=track_synths, workers=max(1, args.workers), **render_options)
+    if args.trace:
+        TRACER.write(args.trace)
+        print(TRACER.summary())
+        print(f"Trace written to {args.trace}")
 
 if __name__ == "__main__":
-    main()
+    run()
     sys.exit()
\ No newline at end of file
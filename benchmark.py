@@ -0,0 +1,214 @@
+"""Benchmark the SongMaker pipeline on synthetic MIDI with a deterministic stand-in synth.
+
+The VSTs in assets/ are win64-only, so this runs render_song on the numpy backend, whose
+NumpySynth plays every note additively, on generated songs of increasing size. Each case
+runs in a fresh process so peak RSS is its own.
+
+    python benchmark.py                      # compare against benchmark_baselines.json
+    python benchmark.py --update-baselines   # record this host's numbers as the baseline
+"""
+import SongMaker
+import mido
+from mido import MidiFile, MidiTrack, MetaMessage, Message
+import os
+import numpy as np
+import json
+import argparse
+import contextlib
+import subprocess
+import tempfile
+import time
+import sys
+import platform
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+BASELINES_PATH = os.path.join(SongMaker.SCRIPT_DIR, "benchmark_baselines.json")
+# The numpy backend ignores plugin and preset, these only label the tracks
+STAND_IN_PLUGIN = "stand-in.vst3"
+STAND_IN_PRESET = "stand-in.vstpreset"
+# Synthetic songs: MIDI tracks, notes per track, song length in seconds
+BENCHMARK_CASES = {
+    'small': dict(num_tracks=4, notes_per_track=200, duration_seconds=30),
+    'medium': dict(num_tracks=8, notes_per_track=1000, duration_seconds=120),
+    'large': dict(num_tracks=16, notes_per_track=2000, duration_seconds=300),
+}
+DEFAULT_CASES = ['small', 'medium']
+TOLERANCE = 0.25  # Relative slowdown (or RSS growth) that fails a comparison
+MIN_SLACK_SECONDS = 0.05  # Stages shorter than this are timer noise
+
+class BenchmarkTracer(SongMaker.StageTracer):
+    """StageTracer that also records how far each stage pushed the peak RSS"""
+
+    @contextlib.contextmanager
+    def stage(self, name, **args):
+        before = peak_rss_bytes()
+        with super().stage(name, **args):
+            yield
+        # The stage's own event is appended last, after any nested ones
+        self.events[-1]['args']['rss_growth'] = peak_rss_bytes() - before
+
+def peak_rss_bytes():
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+def make_synthetic_midi(midi_path, num_tracks, notes_per_track, duration_seconds, seed=0, bpm=120):
+    """Write a multi-track MIDI file of random notes, the same file for the same arguments"""
+    rng = np.random.default_rng(seed)
+    midi = MidiFile(ticks_per_beat=SongMaker.PPQN)
+    ticks_per_second = SongMaker.PPQN * bpm / 60
+    conductor = MidiTrack()
+    conductor.append(MetaMessage('track_name', name='conductor', time=0))
+    conductor.append(MetaMessage('set_tempo', tempo=mido.bpm2tempo(bpm), time=0))
+    midi.tracks.append(conductor)
+
+    for track_index in range(1, num_tracks + 1):
+        starts = np.sort(rng.uniform(0, duration_seconds - 1, notes_per_track))
+        lengths = rng.uniform(0.05, 0.5, notes_per_track)
+        notes = rng.integers(36, 85, notes_per_track)
+        velocities = rng.integers(60, 121, notes_per_track)
+        events = []
+        for start, length, note, velocity in zip(starts, lengths, notes, velocities):
+            events.append((int(start * ticks_per_second), 1, int(note), int(velocity)))
+            events.append((int((start + length) * ticks_per_second), 0, int(note), 0))
+        events.sort()
+
+        track = MidiTrack()
+        track.append(MetaMessage('track_name', name=f"synth{track_index}_v-{track_index % 6}dB", time=0))
+        last_tick = 0
+        for tick, is_on, note, velocity in events:
+            kind = 'note_on' if is_on else 'note_off'
+            track.append(Message(kind, note=note, velocity=velocity, channel=0, time=tick - last_tick))
+            last_tick = tick
+        midi.tracks.append(track)
+    midi.save(midi_path)
+
+def run_case(case, segment_seconds=None):
+    """Render one synthetic song in this process, returns its totals and per-stage numbers"""
+    tracer = SongMaker.TRACER = BenchmarkTracer()
+    with tempfile.TemporaryDirectory() as work_dir:
+        midi_path = os.path.join(work_dir, f"{case}.mid")
+        make_synthetic_midi(midi_path, **BENCHMARK_CASES[case])
+        track_synths = {i: (STAND_IN_PLUGIN, STAND_IN_PRESET)
+                        for i in range(1, BENCHMARK_CASES[case]['num_tracks'] + 1)}
+        start = time.perf_counter()
+        # No stem or MIDI cache, so every run parses and renders from scratch and .midi_cache/ stays untouched
+        audio_seconds = SongMaker.render_song(midi_path, os.path.join(work_dir, f"mixed_{case}.wav"), track_synths,
+                                              cache_dir=None, midi_cache_dir=None, segment_seconds=segment_seconds,
+                                              backend='numpy')
+        wall = time.perf_counter() - start
+
+    stages = {}
+    for event in tracer.events:
+        name = event['name'].split(' ')[0]  # 'track 3' -> 'track'
+        stage = stages.setdefault(name, {'count': 0, 'wall': 0.0, 'cpu': 0.0, 'audio_seconds': 0.0, 'rss_growth': 0})
+        stage['count'] += 1
+        stage['wall'] += event['dur'] / 1e6
+        stage['cpu'] += event['args']['cpu_ms'] / 1000
+        stage['audio_seconds'] += event['args'].get('audio_seconds', 0.0)
+        stage['rss_growth'] += event['args']['rss_growth']
+    for stage in stages.values():
+        stage['realtime_factor'] = stage.pop('audio_seconds') / stage['wall'] if stage['wall'] else 0.0
+    return {'wall': wall, 'audio_seconds': audio_seconds, 'realtime_factor': audio_seconds / wall,
+            'peak_rss': peak_rss_bytes(), 'stages': stages}
+
+def run_case_subprocess(case, segment_seconds=None):
+    """run_case in a fresh interpreter, so peak RSS and module state don't leak between runs"""
+    with tempfile.TemporaryDirectory() as result_dir:
+        result_path = os.path.join(result_dir, 'result.json')
+        command = [sys.executable, os.path.abspath(__file__), '--run-case', case, '--result', result_path]
+        if segment_seconds:
+            command += ['--segment-seconds', str(segment_seconds)]
+        subprocess.run(command, check=True, stdout=subprocess.DEVNULL)
+        with open(result_path) as f:
+            return json.load(f)
+
+def median_result(results):
+    """Per-metric median over repeated runs of one case"""
+    stages = {}
+    for name in results[0]['stages']:
+        runs = [result['stages'][name] for result in results if name in result['stages']]
+        stages[name] = {key: float(np.median([run[key] for run in runs])) for key in runs[0]}
+    return {**{key: float(np.median([result[key] for result in results]))
+               for key in ('wall', 'audio_seconds', 'realtime_factor', 'peak_rss')},
+            'stages': stages}
+
+def print_result(case, result):
+    print(f"\n{case}: {result['audio_seconds']:.1f}s of audio in {result['wall']:.2f}s, "
+          f"{result['realtime_factor']:.1f}x realtime, peak RSS {result['peak_rss'] / 1024 ** 2:.0f} MB")
+    print(f"  {'stage':<14}{'count':>7}{'wall s':>10}{'cpu s':>10}{'rtf':>11}{'RSS +MB':>10}")
+    for name, stage in sorted(result['stages'].items(), key=lambda item: -item[1]['wall']):
+        rtf = f"{stage['realtime_factor']:.1f}x" if stage['realtime_factor'] else '-'
+        print(f"  {name:<14}{stage['count']:>7.0f}{stage['wall']:>10.3f}{stage['cpu']:>10.3f}{rtf:>11}"
+              f"{stage['rss_growth'] / 1024 ** 2:>10.1f}")
+
+def compare_to_baseline(case, result, baseline, tolerance=TOLERANCE):
+    """List every metric of result that is more than tolerance worse than baseline"""
+    failures = []
+
+    def check(label, value, reference, slack=0.0):
+        if value > reference * (1 + tolerance) + slack:
+            failures.append(f"{case} {label}: {value:.3f} vs baseline {reference:.3f}")
+
+    check('wall s', result['wall'], baseline['wall'], MIN_SLACK_SECONDS)
+    check('peak RSS MB', result['peak_rss'] / 1024 ** 2, baseline['peak_rss'] / 1024 ** 2)
+    for name, stage in result['stages'].items():
+        if name in baseline['stages']:
+            check(f'{name} wall s', stage['wall'], baseline['stages'][name]['wall'], MIN_SLACK_SECONDS)
+    return failures
+
+def main(cases=DEFAULT_CASES, repeats=3, baselines_path=BASELINES_PATH, update_baselines=False,
+         tolerance=TOLERANCE, segment_seconds=None):
+    """Run the cases, returns False if any of them regressed against its baseline"""
+    baselines = {}
+    if os.path.exists(baselines_path):
+        with open(baselines_path) as f:
+            baselines = json.load(f)
+
+    failures = []
+    for case in cases:
+        result = median_result([run_case_subprocess(case, segment_seconds) for _ in range(repeats)])
+        print_result(case, result)
+        if update_baselines:
+            baselines[case] = result
+        elif case in baselines:
+            failures += compare_to_baseline(case, result, baselines[case], tolerance)
+        else:
+            print(f"  No baseline for {case}, record one with --update-baselines")
+
+    if update_baselines:
+        baselines['host'] = {'platform': platform.platform(), 'python': platform.python_version(),
+                             'processor': platform.processor()}
+        with open(baselines_path, 'w') as f:
+            json.dump(baselines, f, indent=2)
+        print(f"\nBaselines written to {baselines_path}")
+    for failure in failures:
+        print(f"REGRESSION {failure}")
+    return not failures
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the render pipeline with a deterministic stand-in synth")
+    parser.add_argument('--cases', nargs='+', choices=list(BENCHMARK_CASES), default=DEFAULT_CASES)
+    parser.add_argument('--repeats', type=int, default=3,
+                        help="Runs per case, the median of each metric is reported")
+    parser.add_argument('--baselines', default=BASELINES_PATH)
+    parser.add_argument('--update-baselines', action='store_true',
+                        help="Store this run as the baseline instead of comparing against it")
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE,
+                        help="Relative slowdown or RSS growth over the baseline that counts as a regression")
+    parser.add_argument('--segment-seconds', type=float, default=None,
+                        help="Benchmark the streaming render mode with segments of this length")
+    parser.add_argument('--run-case', default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--result', default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.run_case:
+        with open(args.result, 'w') as f:
+            json.dump(run_case(args.run_case, args.segment_seconds), f)
+        sys.exit()
+    sys.exit(0 if main(args.cases, max(1, args.repeats), args.baselines, args.update_baselines,
+                       args.tolerance, args.segment_seconds) else 1)
@@ -0,0 +1,118 @@
+"""SongMaker command line with one subcommand per job.
+
+    python cli.py render [SongMaker options]    # same options as python SongMaker.py
+    python cli.py duration song.mid [...]       # longest track length in seconds
+    python cli.py dump song.mid [--log]         # every track's messages
+    python cli.py check-deps                    # which dependencies import here
+    python cli.py index library/                # add a MIDI library to the SQLite catalog
+    python cli.py select --where "t.name LIKE '%bass%'"
+
+render imports SongMaker (and with it NumPy and SciPy). duration, dump, index and select
+need nothing but mido and sqlite3, imported when they run (through midi_timing and
+midi_catalog, the mido-only modules SongMaker shares), so they start fast inside loops.
+"""
+import argparse
+import importlib
+import os
+import shutil
+import sys
+import time
+
+DEPENDENCIES = ['dawdreamer', 'numpy', 'scipy', 'mido']
+
+def duration(args):
+    from midi_timing import midi_duration
+    for midi_path in args.midi:
+        track_index, seconds = midi_duration(midi_path)
+        if args.quiet:
+            print(f"{seconds:.3f}")
+        else:
+            print(f"{midi_path}: the longest track is Track {track_index} with a length of {seconds:.2f} seconds.")
+
+def dump(args):
+    import mido
+    for midi_path in args.midi:
+        midi = mido.MidiFile(midi_path)
+        # --log keeps the old <song>.log next to the MIDI file
+        out = open(os.path.splitext(midi_path)[0] + '.log', 'w') if args.log else sys.stdout
+        try:
+            for i, track in enumerate(midi.tracks):
+                print(f"Track {i}: {track.name}", file=out)
+                for msg in track:
+                    print(msg, file=out)
+        finally:
+            if args.log:
+                out.close()
+                print(f"Wrote {out.name}")
+
+def check_deps(args):
+    """Import every dependency and report its version, returns 1 if a required one is missing"""
+    missing = []
+    for package in DEPENDENCIES:
+        try:
+            module = importlib.import_module(package)
+        except ImportError as e:
+            note = " (only the numpy backend can render)" if package == 'dawdreamer' else ""
+            print(f"{package} is not installed{note}: {e}")
+            if package != 'dawdreamer':
+                missing.append(package)
+        else:
+            version = getattr(module, '__version__', None)
+            print(f"{package} {version} is installed" if version else f"{package} is installed")
+    try:
+        importlib.import_module('tomllib')
+        print("tomllib is available, TOML song configs can be read")
+    except ImportError:
+        print("tomllib is not available (Python < 3.11), use JSON song configs")
+    ffmpeg = shutil.which('ffmpeg')
+    print(f"ffmpeg found at {ffmpeg}" if ffmpeg else "ffmpeg not found, --mixer ffmpeg won't work")
+    return 1 if missing else 0
+
+def index(args):
+    import midi_catalog
+    start = time.perf_counter()
+    counts = midi_catalog.index_midi_library(args.library, args.db or midi_catalog.CATALOG_PATH, args.workers)
+    print(', '.join(f"{count} {outcome}" for outcome, count in counts.items()) +
+          f" in {time.perf_counter() - start:.1f}s")
+
+def select(args):
+    import midi_catalog
+    for midi_path in midi_catalog.select_from_catalog(args.where, db_path=args.db or midi_catalog.CATALOG_PATH):
+        print(midi_path)
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    # render hands everything after it to SongMaker's own parser
+    if argv[:1] == ['render']:
+        import SongMaker
+        SongMaker.run(argv[1:], prog='cli.py render')
+        return 0
+
+    parser = argparse.ArgumentParser(prog='cli.py', description="SongMaker tools")
+    subcommands = parser.add_subparsers(dest='command', required=True)
+    subcommands.add_parser('render', help="Render and mix a song, takes SongMaker.py's options")
+    duration_parser = subcommands.add_parser('duration', help="Longest track length of MIDI files")
+    duration_parser.add_argument('midi', nargs='+')
+    duration_parser.add_argument('-q', '--quiet', action='store_true', help="Print only the seconds")
+    duration_parser.set_defaults(handler=duration)
+    dump_parser = subcommands.add_parser('dump', help="Print every track's MIDI messages")
+    dump_parser.add_argument('midi', nargs='+')
+    dump_parser.add_argument('--log', action='store_true', help="Write <song>.log next to each file instead")
+    dump_parser.set_defaults(handler=dump)
+    check_parser = subcommands.add_parser('check-deps', help="Report which dependencies are installed")
+    check_parser.set_defaults(handler=check_deps)
+    index_parser = subcommands.add_parser('index', help="Add or refresh a MIDI library in the SQLite catalog")
+    index_parser.add_argument('library', help="Directory (searched recursively) or glob of MIDI files")
+    index_parser.add_argument('--db', default=None, help="Catalog file, defaults to midi_catalog.CATALOG_PATH")
+    index_parser.add_argument('--workers', type=int, default=1, help="Processes parsing new and changed files")
+    index_parser.set_defaults(handler=index)
+    select_parser = subcommands.add_parser('select', help="Print the catalogued MIDI files matching a condition")
+    select_parser.add_argument('--where', default='1',
+                               help="SQL condition on files f and tracks t, e.g. \"f.duration_seconds < 120\"")
+    select_parser.add_argument('--db', default=None, help="Catalog file, defaults to midi_catalog.CATALOG_PATH")
+    select_parser.set_defaults(handler=select)
+    args = parser.parse_args(argv)
+    return args.handler(args) or 0
+
+if __name__ == "__main__":
+    sys.exit(main())
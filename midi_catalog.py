@@ -0,0 +1,172 @@
+"""SQLite catalog of a MIDI library, needing nothing but mido and sqlite3.
+
+cli.py's index and select import this instead of SongMaker, so selecting what to render
+is a query that starts without NumPy, SciPy or DawDreamer.
+"""
+import glob
+import hashlib
+import json
+import multiprocessing
+import os
+import re
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor
+import mido
+from mido import MidiFile
+from midi_timing import calculate_track_length, tempo_changes, tick_to_seconds
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+CATALOG_PATH = os.path.join(SCRIPT_DIR, "midi_catalog.sqlite")
+
+CATALOG_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER,
+    size INTEGER,
+    sha256 TEXT,
+    ticks_per_beat INTEGER,
+    num_tracks INTEGER,
+    duration_seconds REAL,
+    initial_bpm REAL,
+    tempo_changes INTEGER,
+    tempo_map TEXT,  -- JSON [[tick, microseconds per beat], ...]
+    error TEXT,      -- Set instead of the metadata when the file doesn't parse
+    indexed_at REAL
+);
+CREATE TABLE IF NOT EXISTS tracks (
+    path TEXT REFERENCES files(path) ON DELETE CASCADE,
+    track_index INTEGER,
+    name TEXT,
+    db_value REAL,   -- The _v<dB>dB tag of the name, NULL without one
+    note_count INTEGER,
+    length_ticks INTEGER,
+    length_seconds REAL,
+    PRIMARY KEY (path, track_index)
+);
+CREATE INDEX IF NOT EXISTS files_sha256 ON files(sha256);
+CREATE INDEX IF NOT EXISTS tracks_name ON tracks(name);
+"""
+
+def extract_db_from_track_name(track_name):
+    match = re.search(r'_v(-?\d+(\.\d+)?)dB', track_name)
+    if match:
+        return float(match.group(1))
+    return None
+
+def find_midi_files(pattern):
+    """A directory means every .mid in it (recursively), anything else is a glob pattern"""
+    if os.path.isdir(pattern):
+        pattern = os.path.join(pattern, '**', '*.mid')
+    return sorted(glob.glob(pattern, recursive=True))
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def open_catalog(db_path=CATALOG_PATH):
+    connection = sqlite3.connect(db_path)
+    connection.execute('PRAGMA foreign_keys = ON')
+    connection.executescript(CATALOG_SCHEMA)
+    return connection
+
+def catalog_entry(midi_path, file_hash):
+    """Parse one MIDI file into its files row values and tracks rows for the catalog"""
+    try:
+        midi = MidiFile(midi_path)
+    except Exception as e:
+        return {'sha256': file_hash, 'error': f"{type(e).__name__}: {e}"}, []
+    changes = tempo_changes(midi)
+    track_rows = []
+    for i, track in enumerate(midi.tracks):
+        length_ticks = calculate_track_length(track)
+        note_count = sum(1 for msg in track if msg.type == 'note_on' and msg.velocity > 0)
+        track_rows.append((midi_path, i, track.name, extract_db_from_track_name(track.name), note_count, length_ticks,
+                           tick_to_seconds(length_ticks, changes, midi.ticks_per_beat)))
+    longest_ticks = max((row[5] for row in track_rows), default=0)
+    file_values = {
+        'sha256': file_hash,
+        'ticks_per_beat': midi.ticks_per_beat,
+        'num_tracks': len(midi.tracks),
+        'duration_seconds': tick_to_seconds(longest_ticks, changes, midi.ticks_per_beat),
+        'initial_bpm': mido.tempo2bpm(changes[0]),
+        'tempo_changes': len(changes) - 1,
+        'tempo_map': json.dumps([[tick, changes[tick]] for tick in sorted(changes)]),
+        'error': None,
+    }
+    return file_values, track_rows
+
+def _catalog_job(midi_path):
+    file_hash = file_sha256(midi_path)
+    return (file_hash, *catalog_entry(midi_path, file_hash))
+
+def index_midi_library(pattern, db_path=CATALOG_PATH, workers=1):
+    """Add every MIDI file matching pattern to the SQLite catalog at db_path, returns counts per outcome.
+
+    Files whose mtime and size match their row are skipped without being read, files
+    whose content hash still matches only get their mtime updated. When pattern is a
+    directory, rows of files that are gone from it are deleted.
+    """
+    connection = open_catalog(db_path)
+    known = {path: (mtime_ns, size, sha256) for path, mtime_ns, size, sha256
+             in connection.execute('SELECT path, mtime_ns, size, sha256 FROM files')}
+    counts = dict.fromkeys(['added', 'updated', 'unchanged', 'touched', 'removed'], 0)
+
+    to_parse = []
+    seen = set()
+    for midi_path in find_midi_files(pattern):
+        midi_path = os.path.abspath(midi_path)
+        seen.add(midi_path)
+        stat = os.stat(midi_path)
+        if known.get(midi_path, (None, None))[:2] == (stat.st_mtime_ns, stat.st_size):
+            counts['unchanged'] += 1
+        else:
+            to_parse.append((midi_path, stat))
+
+    def store(midi_path, stat, file_hash, file_values, track_rows):
+        if midi_path in known and known[midi_path][2] == file_hash:
+            connection.execute('UPDATE files SET mtime_ns = ?, size = ? WHERE path = ?',
+                               (stat.st_mtime_ns, stat.st_size, midi_path))
+            counts['touched'] += 1
+            return
+        counts['updated' if midi_path in known else 'added'] += 1
+        connection.execute('DELETE FROM files WHERE path = ?', (midi_path,))
+        row = {'path': midi_path, 'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size,
+               'indexed_at': time.time(), **file_values}
+        connection.execute(f"INSERT INTO files ({', '.join(row)}) VALUES ({', '.join('?' * len(row))})",
+                           list(row.values()))
+        connection.executemany('INSERT INTO tracks VALUES (?, ?, ?, ?, ?, ?, ?)', track_rows)
+
+    with connection:
+        if workers > 1 and len(to_parse) > 1:
+            context = multiprocessing.get_context('spawn')
+            with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+                results = executor.map(_catalog_job, [midi_path for midi_path, _ in to_parse], chunksize=16)
+                for (midi_path, stat), result in zip(to_parse, results):
+                    store(midi_path, stat, *result)
+        else:
+            for midi_path, stat in to_parse:
+                store(midi_path, stat, *_catalog_job(midi_path))
+
+        if os.path.isdir(pattern):
+            root = os.path.join(os.path.abspath(pattern), '')
+            gone = [(path,) for path in known if path.startswith(root) and path not in seen]
+            connection.executemany('DELETE FROM files WHERE path = ?', gone)
+            counts['removed'] = len(gone)
+    connection.close()
+    return counts
+
+def select_from_catalog(where='1', params=(), db_path=CATALOG_PATH):
+    """Paths of the parsed files matching an SQL condition on files f and tracks t, e.g.
+    "f.duration_seconds < 120 AND t.name LIKE '%bass%'"
+    """
+    connection = open_catalog(db_path)
+    try:
+        rows = connection.execute('SELECT DISTINCT f.path FROM files f LEFT JOIN tracks t ON t.path = f.path '
+                                  f'WHERE f.error IS NULL AND ({where}) ORDER BY f.path', params).fetchall()
+    finally:
+        connection.close()
+    return [path for path, in rows]
@@ -0,0 +1,45 @@
+"""MIDI timing helpers that need nothing but mido, shared by SongMaker.py and cli.py.
+
+cli.py's duration imports this instead of SongMaker, so it starts without NumPy and SciPy.
+"""
+import mido
+
+DEFAULT_TEMPO = 500000  # 120 BPM in microseconds per beat, MIDI's tempo until the first set_tempo
+
+def calculate_track_length(track):
+    total_time = 0
+    for msg in track:
+        total_time += msg.time
+        if msg.type == 'end_of_track':
+            break
+    return total_time
+
+def tempo_changes(midi):
+    """{tick: tempo} of every set_tempo in the file, always starting at tick 0; the last change on a tick wins"""
+    changes = {0: DEFAULT_TEMPO}
+    for track in midi.tracks:
+        tick = 0
+        for msg in track:
+            tick += msg.time
+            if msg.type == 'set_tempo':
+                changes[tick] = msg.tempo
+    return changes
+
+def tick_to_seconds(tick, changes, ticks_per_beat):
+    """Seconds at an absolute tick through every tempo change, SongMaker's ticks_to_seconds for one tick"""
+    seconds = 0.0
+    change_ticks = sorted(changes)
+    for i, start in enumerate(change_ticks):
+        if start >= tick:
+            break
+        stop = min(change_ticks[i + 1], tick) if i + 1 < len(change_ticks) else tick
+        seconds += mido.tick2second(stop - start, ticks_per_beat, changes[start])
+    return seconds
+
+def midi_duration(midi_path):
+    """(longest track index, its length in seconds) through every tempo change of the file"""
+    midi = mido.MidiFile(midi_path)
+    lengths = [calculate_track_length(track) for track in midi.tracks]
+    longest_index = max(range(len(lengths)), key=lengths.__getitem__, default=-1)
+    end_tick = lengths[longest_index] if lengths else 0
+    return longest_index, tick_to_seconds(end_tick, tempo_changes(midi), midi.ticks_per_beat)